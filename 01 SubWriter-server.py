@@ -1,7 +1,14 @@
 
 import json
-from multiprocessing import Process, Queue
-from os import path, sep, mkdir, makedirs, getcwd, chdir
+import math
+import queue
+import shutil
+import tempfile
+import threading
+import itertools
+import multiprocessing
+from multiprocessing import Process, Queue, RawArray
+from os import path, sep, mkdir, makedirs, getcwd, chdir, cpu_count
 import sys
 if 'BASE_DIR' not in globals():
     BASE_DIR = path.dirname(__file__); 
@@ -17,11 +24,13 @@ import re
 import asyncio
 from pathlib import Path
 from datetime import timedelta
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 
 import websockets
 
-from util import chinese_itn, format_tools
+from util import chinese_itn, format_tools, chunking, punctuation, segments, metrics, tuning
+from util.result_cache import ResultCache
+from util.job_store import JobStore
 
 
 
@@ -36,6 +45,16 @@ tokens_path = Path() / 'models' / 'paraformer' /  'tokens.txt'
 
 punc_model_dir = Path() / 'models' /  'punc_ct' 
 
+# 收到的音频先写入这个目录下的暂存文件，识别进程按路径以内存映射方式读取，不经过队列传递
+# 优先用内存盘 /dev/shm，没有的话就用系统临时目录
+audio_dir = (Path('/dev/shm') if Path('/dev/shm').is_dir() else Path(tempfile.gettempdir())) / 'SubWriter'
+
+cache_dir = Path() / 'cache'    # 识别结果缓存目录，同一段音频再次提交时直接返回缓存的结果
+cache_max_mb = 1024             # 缓存总大小上限，超出后删除最久没用到的
+
+checkpoint_dir = Path() / 'checkpoints' # 长音频的断点记录，中断后再次提交同一任务，从最后完成的窗口接着识别
+checkpoint_max_days = 7                 # 超过这么多天没有再提交的断点记录，启动时删除
+
 class args:
     paraformer = f'{paraformer_path}' 
     tokens = f'{tokens_path}'
@@ -45,6 +64,39 @@ class args:
     decoding_method = 'greedy_search'
     debug = False
 
+num_workers = 2     # 识别进程数，每个进程各载入一份模型，num_workers × num_threads 不宜超过 CPU 核数
+share_models = True # 支持 fork 的系统上，主进程先载入语音模型，再 fork 出识别进程，共享同一份只读的模型权重
+                    # onnxruntime 的线程池在 fork 之后不能用，所以只在 num_threads 为 1 时生效
+
+auto_tune = True        # 按实测选出的 线程数 × 识别进程数，覆盖上面的 args.num_threads 和 num_workers
+                        # 第一次启动，或者换了机器、模型时，先实测一遍，结果存入 tune_file，之后直接沿用
+                        # 启动时加上 --calibrate 参数，则无论如何都重新实测
+tune_for = 'throughput' # throughput：多个任务同时识别时，总吞吐量最高；latency：每一段识别得最快
+tune_file = Path() / 'models' / 'tuning.json'
+tune_max_workers = 8    # 实测时最多试到几个识别进程，每个进程各占一份模型的内存
+tune_rounds = 3         # 实测时，每个进程识别几段合成的音频
+
+num_text_workers = 1    # 加标点、转数字的进程数，与识别进程分开，识别下一个任务时，上一个任务可以同时加标点
+punc_window = 300       # 加标点时，文本按多少字一段送入标点模型，长文本的内存占用不随长度增长
+punc_context = 30       # 每段两侧各带多少字的上下文，段与段的交界处也能加对标点
+punc_threads = 2        # 每个文本进程同时有几段在标点模型中
+
+batch_size = 1          # 一次送入模型解码的窗口数，1 即逐段串行解码
+split_seconds = 600     # 超过这个时长的整段音频，拆成窗口分给所有识别进程并行识别
+
+max_queued_jobs = 32    # 最多同时有多少个任务在排队或识别，超出的直接回复繁忙
+max_buffered_mb = 2048  # 排队和识别中的任务，暂存音频的总大小上限，超出的直接回复繁忙
+chunk_mode = 'fixed'    # fixed：按固定长度切分；silence：在停顿处切分，停顿处两段不重叠，省去重复识别
+chunk_seconds = 15      # 以多少秒为一段
+overlap_seconds = 2     # 两段之间重叠多少秒，silence 模式下只有找不到停顿时才重叠
+silence_min_seconds = 12    # silence 模式下，每段最短多少秒
+silence_max_seconds = 24    # silence 模式下，每段最长多少秒
+
+metrics_addr = '127.0.0.1'  # 运行统计只给本机看，Prometheus 格式，地址为 http://127.0.0.1:6009/metrics
+metrics_port = 6009         # 设为 0 则不提供
+trace_dir = None            # 设为 Path() / 'traces' 的话，每个任务结束后写一个各阶段耗时的 trace 文件，
+                            # 可以用 chrome://tracing 或 ui.perfetto.dev 打开
+
 
 
 # ========================================================================
@@ -68,6 +120,19 @@ class Segment:
         s += self.text
         return re.sub(r'(,\d{3})\d+', r'\1', s)
 
+recognizer = None                   # 语音模型，共享模式下在主进程里载入，fork 出的识别进程直接使用
+punc_model = None                   # 标点模型，只在文本进程中载入
+
+# 运行统计，只在主进程里记录，识别进程、文本进程把各阶段耗时随结果送回来
+registry = metrics.Registry()
+stage_seconds = registry.histogram('subwriter_stage_seconds', '各阶段耗时：排队、pcm 转换、每段解码、去重拼接、加标点、转数字、调空格、分句、发送', label='stage')
+job_seconds = registry.histogram('subwriter_job_seconds', '每个任务从收到到返回结果的耗时')
+jobs_total = registry.counter('subwriter_jobs_total', '任务数，按结果分：done、busy、too_large、cancelled、error', label='result')
+audio_seconds_total = registry.counter('subwriter_audio_seconds_total', '已识别的音频总时长')
+registry.gauge('subwriter_queue_depth', '识别队列和文本队列里等待的消息数', function=lambda: queue_in.qsize() + queue_text.qsize())
+registry.gauge('subwriter_inflight_jobs', '排队和识别中的任务数', function=lambda: active_jobs)
+registry.gauge('subwriter_buffered_bytes', '排队和识别中的任务，暂存音频的总字节数', function=lambda: buffered_bytes())
+
 def signal_handler(sig, frame):
     print("收到中断信号 Ctrl+C，退出程序")
     sys.exit(0)
@@ -91,100 +156,218 @@ def splash():
     console.print(f'项目地址：[cyan underline]https://github.com/HaujetZhao/SubWriter', end='\n\n')
 
 
-def recognize(data):
-    sample_rate = args.sample_rate
-    chunk_seconds = 15      # 以多少秒为一段
-    overlap_seconds = 2     # 两段之间重叠多少秒
-    frames_per_chunk = int(sample_rate * chunk_seconds)  
-
-    index = 0
-    timestamps = []
-    tokens = []
-    progress = 0  # 记录已经识别了多少秒
-    while index < len(data):
-
-        # 每帧数据 2Byte
-        start = index
-        end = index + (frames_per_chunk * 2) + (overlap_seconds * sample_rate * 2)
-        chunk = data[start : end]
-        if not chunk: break
-        index += frames_per_chunk * 2
-        
-        # 转换音频片段
-        samples = np.frombuffer(chunk, dtype=np.int16)
-        samples = samples.astype(np.float32) / 32768
-        
-        # 识别
+def load_samples(handles):
+    '''
+    handles 是若干个 (暂存文件, 起始字节, 结束字节)
+    以内存映射方式读出 int16 音频，一次性转为 float32，依次放进可复用的缓冲区，返回各段的视图
+    '''
+    global sample_buffer
+    sizes = [(end - start) // 2 for file, start, end in handles]
+    if sample_buffer.size < sum(sizes):
+        sample_buffer = np.empty(sum(sizes), dtype=np.float32)
+
+    samples_list = []
+    offset = 0
+    for (file, start, end), size in zip(handles, sizes):
+        samples = sample_buffer[offset : offset + size]
+        try:
+            pcm = np.memmap(file, dtype=np.int16, mode='r', offset=start, shape=(size,))
+            np.multiply(pcm, np.float32(1 / 32768), out=samples, dtype=np.float32)
+            del pcm
+        except FileNotFoundError:       # 任务刚刚结束，暂存文件已删除，结果也会被丢弃，填静音即可
+            samples[:] = 0
+        samples_list.append(samples)
+        offset += size
+    return samples_list
+
+def decode_chunks(handles, stages=None):
+    '''
+    识别多个音频片段，batch_size 大于 1 时一次性送入模型批量解码
+    给了 stages 的话，每一段的 pcm 转换、解码耗时各记一条，批量解码的耗时平均分给每一段
+    '''
+    batch_stages = {}
+    with metrics.timer(batch_stages, 'pcm'):
+        samples_list = load_samples(handles)
+    streams = []
+    for samples in samples_list:
         stream = recognizer.create_stream()
         stream.accept_waveform(args.sample_rate, samples)
-        recognizer.decode_stream(stream); 
-
-        # 粗去重
-        m = n = len(stream.result.timestamps)
-        for i, timestamp in enumerate(stream.result.timestamps, start=0):
-            if timestamp > overlap_seconds / 2: 
-                m = i; break 
-        for i, timestamp in enumerate(stream.result.timestamps, start=1):
-            n = i
-            if timestamp > chunk_seconds + overlap_seconds / 2: break 
-        if start == 0: m = 0
-        if index >= len(data): n = len(stream.result.timestamps)
-
-        # 细去重
-        if tokens and tokens[-2:] == stream.result.tokens[m:n][:2]: m += 2
-        elif tokens and tokens[-1:] == stream.result.tokens[m:n][:1]: m += 1
-
-        # 收集结果
-        timestamps += [t + progress for t in stream.result.timestamps[m:n]]
-        tokens += [token for token in stream.result.tokens[m:n]]
-
-        # 更新进度
-        progress += chunk_seconds
-        print(f'\r识别进度：{progress}s', end='', flush=True)
-
-    # token 合并为文本
-    text = ' '.join(tokens).replace('@@ ', '')
-    text = re.sub('([^a-zA-Z0-9]) (?![a-zA-Z0-9])', r'\1', text)
-
-    
-    text = format_tools.adjust_space(text)      # 调空格
-    try: text = punc_model(text)[0]             # 加标点
-    except: ...
-    text = chinese_itn.chinese_to_num(text)     # 转数字
-    text = format_tools.adjust_space(text)      # 调空格
-
-    
+        streams.append(stream)
+
+    # 识别
+    with metrics.timer(batch_stages, 'decode'):
+        if len(streams) == 1: recognizer.decode_stream(streams[0])
+        else: recognizer.decode_streams(streams)
+
+    if stages is not None:
+        for stage, [(started, seconds)] in batch_stages.items():
+            stages.setdefault(stage, []).extend([(started, seconds / len(streams))] * len(streams))
+    return [(stream.result.timestamps, stream.result.tokens) for stream in streams]
+
+def make_splitter(file):
+    '''按 chunk_mode 创建切分器，silence 模式要从暂存文件里读音频找停顿'''
+    if chunk_mode == 'silence':
+        return chunking.SilenceSplitter(args.sample_rate, file, silence_min_seconds, silence_max_seconds, overlap_seconds)
+    return chunking.Splitter(args.sample_rate, chunk_seconds, overlap_seconds)
+
+def split_file(file) -> list:
+    return make_splitter(file).finish(path.getsize(file))
+
+def is_cancelled(job_id) -> bool:
+    '''主进程在连接断开、任务结束时，会在 cancel_flags 里把对应的任务标记为取消'''
+    return job_id is not None and cancel_flags[job_id % len(cancel_flags)] == 1
+
+def recognize(file, job_id=None, key=None, stages=None):
+    '''
+    识别整个暂存文件里的音频，每识别一批窗口检查一次任务是否已被取消，取消了就返回 None
+    给了 key 的话，每拼接完一个窗口就记一次断点，有断点记录的，从最后完成的窗口接着识别
+    给了 stages 的话，把各阶段耗时记在里面
+    '''
+    stages = {} if stages is None else stages
+    if is_cancelled(job_id): return None        # 排在别的批次后面时可能已经取消，暂存文件已删除
+    windows = split_file(file)
+    stitcher = chunking.Stitcher(args.sample_rate)
+    done = 0
+    if key:
+        done, timestamps, tokens, progress = job_store.load(key)
+        stitcher.restore(timestamps, tokens, progress)
+        if done: print(f'\r任务 {job_id} 从断点继续，已识别 {progress:.0f}s')
+    for i in range(done, len(windows), batch_size):
+        if is_cancelled(job_id): 
+            print(f'\r任务 {job_id} 已取消'); return None
+        batch = windows[i : i + batch_size]
+        results = decode_chunks([(file, window.start, window.end) for window in batch], stages)
+        for window, (timestamps, tokens) in zip(batch, results):
+            with metrics.timer(stages, 'dedup'):
+                timestamps, tokens = stitcher.merge(window, timestamps, tokens)    # 按顺序去重、收集结果
+            if key: job_store.append(key, window.index, stitcher.progress, timestamps, tokens)
+        print(f'\r识别进度：{stitcher.progress:.0f}s', end='', flush=True)
+
+    return stitcher.timestamps, stitcher.tokens
+
+def post_process(timestamps, tokens, stages=None):
+    stages = {} if stages is None else stages
+
+    # token 合并为文本，owners 记下每个字来自第几个 token，每处理一步都跟着更新
+    text, owners = segments.join_tokens(tokens)
+
+    def step(stage, function):
+        nonlocal text, owners
+        with metrics.timer(stages, stage): new_text = function(text)
+        with metrics.timer(stages, 'segments'): owners = segments.carry(text, new_text, owners)
+        text = new_text
+
+    step('spacing', lambda text: re.sub('([^a-zA-Z0-9]) (?![a-zA-Z0-9])', r'\1', text))
+    step('spacing', format_tools.adjust_space)      # 调空格
+    if punc_model:                                  # 分段加标点
+        step('punctuation', lambda text: punctuation.punctuate(text, punc_model, punc_window, punc_context, punc_threads))
+    step('itn', chinese_itn.chinese_to_num)         # 转数字
+    step('spacing', format_tools.adjust_space)      # 调空格
+
+    # 在标点处分句，每句的时间取自它的第一个和最后一个字
+    with metrics.timer(stages, 'segments'):
+        sentences = [Segment(start, round(end - start, 3), sentence.strip()) 
+                     for start, end, sentence in segments.split_segments(text, owners, timestamps)]
 
-    
     # 发送回去
     message = {'timestamps': timestamps, 
                             'tokens': tokens, 
-                            'text': text}
+                            'text': text, 
+                            'segments': [asdict(sentence) for sentence in sentences]}
     
     return message 
 
-def init_recognizer(queue_in: Queue, queue_out: Queue):
-    global np
-    global recognizer
-    global punc_model
+def init_recognizer(worker_id: int, queue_in: Queue, queue_out: Queue, flags: RawArray, busy: RawArray, num_threads: int):
+    global cancel_flags; cancel_flags = flags
+    args.num_threads = num_threads      # 自动选择的线程数只在主进程里设置了，spawn 出的进程要从参数拿到
+    global job_store; job_store = JobStore(checkpoint_dir)
 
-    with console.status("载入模块中…", spinner="bouncingBall", spinner_style="yellow"):
-        import numpy as np
-        import sherpa_onnx
-        from funasr_onnx import CT_Transformer
-    console.print('[green4]模块加载完成', end='\n\n')
+    # 重定向 ctrl-c 行为
+    import signal
+    signal.signal(signal.SIGINT, signal_handler)
 
-    # 关闭 jieba 的 debug
-    import jieba
-    import logging
-    jieba.setLogLevel(logging.INFO)
+    load_models(worker_id)  # 如果是从已载入语音模型的主进程 fork 出来的，就不用再载入了
+    queue_out.put((None, worker_id)) # 通知主进程加载完了
+
+    while True:
+        tasks = [queue_in.get()]        # 从队列中获取任务消息
+        started = time.time()           # 取到任务的时间，主进程据此统计排队等待时长
+
+        # 按窗口提交的任务，如果队列里还有，就多取几个，凑成一批解码
+        while len(tasks) < batch_size and tasks[-1][0] == 'chunk':
+            try: tasks.append(queue_in.get_nowait())
+            except queue.Empty: break
+
+        # 已取消的任务（连接断开或命中了缓存），不必再识别
+        tasks = [task for task in tasks if not is_cancelled(task[1])]
+        chunk_tasks = [task for task in tasks if task[0] == 'chunk']
+        if chunk_tasks:
+            stages = {}
+            try:
+                results = decode_chunks([handle for kind, job_id, (index, handle) in chunk_tasks], stages)
+            except Exception as e:
+                for kind, job_id, payload in chunk_tasks: report_error(queue_out, job_id, started, e)
+                results = []
+            for i, ((kind, job_id, (index, handle)), result) in enumerate(zip(chunk_tasks, results)):
+                chunk_stages = {stage: records[i : i + 1] for stage, records in stages.items()}
+                queue_out.put((job_id, kind, (index, *result), started, chunk_stages))
+
+        for kind, job_id, payload in tasks:
+            if kind != 'recognize': continue
+            file, key = payload                         # 整个文件：识别、拼接，加标点交给文本进程
+            stages = {}
+            try:
+                result = recognize(file, job_id, key, stages)
+            except Exception as e:
+                report_error(queue_out, job_id, started, e); continue
+            if result is None: continue
+            queue_out.put((job_id, kind, result, started, stages))  # 带上任务 id 返回结果
+
+        busy[worker_id] += time.time() - started
+
+def init_text_worker(worker_id: int, queue_text: Queue, queue_out: Queue, flags: RawArray, busy: RawArray, busy_index: int):
+    '''文本进程：给拼接好的识别结果加标点、转数字，与识别进程并行，busy_index 是它在 busy 中的位置'''
+    global cancel_flags; cancel_flags = flags
 
     # 重定向 ctrl-c 行为
     import signal
     signal.signal(signal.SIGINT, signal_handler)
-    
 
-    rich.print('[yellow]语音模型载入中', end='\r'); t1 = time.time()
+    load_punc_model(worker_id)  # 与识别进程载入语音模型同时进行，载入完之前，任务在队列里等着
+
+    while True:
+        kind, job_id, payload = queue_text.get()
+        started = time.time()
+        if is_cancelled(job_id): continue
+        stages = {}
+        try:
+            result = post_process(*payload, stages=stages)
+        except Exception as e:
+            report_error(queue_out, job_id, started, e); continue
+        queue_out.put((job_id, kind, result, started, stages))
+        busy[busy_index] += time.time() - started
+
+def report_error(queue_out: Queue, job_id, started: float, error: Exception):
+    '''任务出错时，把出错信息当作结果送回主进程，进程接着处理别的任务；已取消的任务不必回复'''
+    if is_cancelled(job_id): return
+    print(f'\r任务 {job_id} 出错：{error!r}')
+    queue_out.put((job_id, 'error', f'{type(error).__name__}: {error}', started, {}))
+
+def load_models(worker_id: int = 0):
+    if recognizer is None: load_asr_model(f'识别进程 {worker_id}')
+
+def load_asr_model(name: str):
+    global np
+    global recognizer
+    global sample_buffer
+
+    with console.status(f"{name} 载入模块中…", spinner="bouncingBall", spinner_style="yellow"):
+        import numpy as np
+        import sherpa_onnx
+    console.print(f'[green4]{name} 模块加载完成', end='\n\n')
+    sample_buffer = np.empty(0, dtype=np.float32)
+
+    rich.print(f'[yellow]{name} 语音模型载入中', end='\r'); t1 = time.time()
     recognizer = sherpa_onnx.OfflineRecognizer.from_paraformer(
         paraformer=args.paraformer,
         tokens=args.tokens,
@@ -193,42 +376,491 @@ def init_recognizer(queue_in: Queue, queue_out: Queue):
         feature_dim=args.feature_dim,
         decoding_method=args.decoding_method,
         debug=args.debug,)
-    rich.print(f'[green4]语音模型载入完成', end='\n');print('')
+    rich.print(f'[green4]{name} 语音模型载入完成', end='\n');print('')
+    console.print(f'{name} 语音模型加载耗时 {time.time() - t1 :.2f}s', end='\n\n')
+
+def calibrate_worker(threads: int, file: str, queue_in: Queue, queue_out: Queue):
+    '''实测用的识别进程：以 threads 个线程载入语音模型，每收到一个数字 n，就把合成的音频识别 n 遍，返回每遍的耗时'''
+    import signal
+    signal.signal(signal.SIGINT, signal_handler)
 
-    rich.print('[yellow]标点模型载入中', end='\r')
-    punc_model = None
-    # punc_model = CT_Transformer(punc_model_dir, quantize=True)
-    console.print(f'[green4]标点模型载入完成', end='\n\n')
+    args.num_threads = threads
+    load_asr_model(f'实测进程（{threads} 线程）')
+    queue_out.put(None)
+    while (rounds := queue_in.get()) is not None:
+        durations = []
+        for _ in range(rounds):
+            t1 = time.time()
+            decode_chunks([(file, 0, path.getsize(file))])
+            durations.append(time.time() - t1)
+        queue_out.put(durations)
+
+def calibrate() -> list[dict]:
+    '''
+    逐个实测 线程数 × 进程数 的组合，每种线程数起一批进程，各自载入模型，
+    再让其中 1 个、2 个……同时识别一段窗口长度的合成音频，记下吞吐量和每段耗时
+    '''
+    import numpy as np
+    window_seconds = chunk_seconds + overlap_seconds
+    file = audio_dir / 'calibrate.pcm'
+    rng = np.random.default_rng(0)      # 轻微的噪声，比纯静音更接近真实的解码量
+    file.write_bytes((rng.normal(0, 1000, window_seconds * args.sample_rate)).astype(np.int16).tobytes())
+
+    layouts = tuning.candidates(cpu_count() or 1, tune_max_workers)
+    results = []
+    for threads in sorted({threads for threads, workers in layouts}):
+        max_workers = max(workers for t, workers in layouts if t == threads)
+        queues_in, queue_out = [Queue() for _ in range(max_workers)], Queue()
+        processes = [Process(target=calibrate_worker, args=(threads, str(file), queue, queue_out), daemon=True) 
+                     for queue in queues_in]
+        for process in processes: process.start()
+        for queue in queues_in: queue_out.get()         # 等待载入完成
+        for queue in queues_in: queue.put(1)            # 预热
+        for queue in queues_in: queue_out.get()
+
+        for workers in range(1, max_workers + 1):
+            t1 = time.time()
+            for queue in queues_in[:workers]: queue.put(tune_rounds)
+            durations = sum((queue_out.get() for _ in range(workers)), [])
+            result = {'threads': threads, 'workers': workers, 
+                      'throughput': round(workers * tune_rounds * window_seconds / (time.time() - t1), 2), 
+                      'latency': round(sum(durations) / len(durations), 4)}
+            console.print(f'{threads} 线程 × {workers} 进程：每秒识别 {result["throughput"]:.1f} 秒音频，'
+                          f'每段 {result["latency"]:.3f}s', end='\n\n')
+            results.append(result)
+
+        for queue in queues_in: queue.put(None)
+        for process in processes: process.join()
+    file.unlink(missing_ok=True)
+    return results
+
+def tune():
+    '''按实测结果设置线程数和识别进程数，没有实测过，或者加了 --calibrate，就先实测'''
+    global num_workers
+    identity = {'cpu_count': cpu_count(), 
+                'paraformer': args.paraformer, 
+                'paraformer_mtime': paraformer_path.stat().st_mtime, 
+                'window_seconds': chunk_seconds + overlap_seconds, }
+    choice = None if '--calibrate' in sys.argv else tuning.load(tune_file, identity, tune_for)
+    if choice is None:
+        console.rule('[yellow]实测线程数与识别进程数'); console.line()
+        results = calibrate()
+        choice = tuning.choose(results, tune_for)
+        tuning.save(tune_file, identity, tune_for, choice, results)
+    args.num_threads, num_workers = choice['threads'], choice['workers']
+    console.print(f'识别进程：{num_workers} 个，每个 {args.num_threads} 线程（按 {tune_file} 中的实测结果）', end='\n\n')
+
+def load_punc_model(worker_id: int = 0):
+    global punc_model
+
+    # 关闭 jieba 的 debug
+    import jieba
+    import logging
+    jieba.setLogLevel(logging.INFO)
 
-    console.print(f'模型加载耗时 {time.time() - t1 :.2f}s', end='\n\n')
-    queue_out.put(True) # 通知主进程加载完了
+    t1 = time.time()
+    try:
+        from funasr_onnx import CT_Transformer
+        punc_model = CT_Transformer(punc_model_dir, quantize=True)
+        console.print(f'[green4]文本进程 {worker_id} 标点模型载入完成，耗时 {time.time() - t1 :.2f}s', end='\n\n')
+    except Exception as e:
+        console.print(f'文本进程 {worker_id} 标点模型载入失败，将不加标点：{e}', style='bright_red')
 
+def dispatch_results(queue_out: Queue):
+    '''在线程中运行，把识别进程返回的结果，按任务 id 放进对应连接的回复队列'''
     while True:
-        data = queue_in.get()       # 从队列中获取任务消息
-        message = recognize(data)   # 执行识别
-        queue_out.put(message)      # 返回结果
+        job_id, kind, result, started, stages = queue_out.get()
+        # job_traces 只在事件循环里读写，这里不直接改，免得与 write_trace、取消任务时的 pop 同时进行
+        loop.call_soon_threadsafe(record_stages, job_id, stages)
+        reply = jobs.get(job_id)
+        if reply is None: continue      # 对应的连接已经不在了，丢弃结果
+        job_started.setdefault(job_id, started)     # 记下任务第一次被识别进程取到的时间
+        loop.call_soon_threadsafe(reply.put_nowait, (kind, result))
+
+def record_stages(job_id, stages: dict):
+    '''把各阶段耗时记入统计，开启了 trace 的话，也记入这个任务的 trace，只在事件循环里调用'''
+    for stage, records in stages.items():
+        for started, seconds in records: stage_seconds.observe(seconds, stage)
+        if (trace := job_traces.get(job_id)) is not None: trace += [(stage, started, seconds) for started, seconds in records]
+
+def write_trace(job_id, audio_seconds: float):
+    '''写出 Chrome trace 格式的 json，每个阶段一行，时间以微秒计'''
+    records = job_traces.pop(job_id, None)
+    if not records: return
+    events = [{'name': stage, 'ph': 'X', 'pid': job_id, 'tid': stage, 
+               'ts': round(started * 1e6), 'dur': round(seconds * 1e6)} for stage, started, seconds in records]
+    trace = {'traceEvents': events, 'otherData': {'job_id': job_id, 'audio_seconds': audio_seconds}}
+    file = trace_dir / f'{time.strftime("%Y%m%d-%H%M%S")}-{job_id}.json'
+    try:
+        with open(file, 'w', encoding='utf-8') as f: json.dump(trace, f)
+    except OSError as e:
+        print(f'trace 文件写入失败：{e}')
+
+def cancel(job_id):
+    '''标记任务为已取消，识别进程会跳过它还在排队的窗口，并中止正在识别的整段音频'''
+    cancel_flags[job_id % len(cancel_flags)] = 1
+
+async def until_closed(websocket, task: asyncio.Task):
+    '''等待任务完成，返回其结果；如果客户端先断开了连接，就取消任务，返回 None'''
+    closed = asyncio.ensure_future(websocket.wait_closed())
+    try:
+        await asyncio.wait({task, closed}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        closed.cancel()
+    if task.done(): return task.result()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return None
+
+def enqueue(kind, job_id, payload):
+    '''把任务放进识别队列（加标点的放进文本队列），并记下任务第一次入队的时间'''
+    job_queued.setdefault(job_id, time.time())
+    if kind == 'text': queue_text.put((kind, job_id, payload))
+    else: queue_in.put((kind, job_id, payload))
+
+class RecognizeError(Exception):
+    '''识别进程、文本进程处理任务时出错，消息是进程送回的出错信息'''
+
+def check_reply(kind, result):
+    if kind == 'error': raise RecognizeError(result)
+
+async def submit(kind, job_id, payload):
+    '''提交一个整体任务，等待它的结果'''
+    reply = jobs[job_id] = asyncio.Queue()
+    try:
+        enqueue(kind, job_id, payload)
+        kind, result = await reply.get()
+    finally:
+        jobs.pop(job_id, None)
+    check_reply(kind, result)
+    return result
+
+class WindowJob:
+    '''
+    把一个任务的各个窗口分给识别进程池，收集结果，按窗口顺序拼接
+    同一任务同时在识别的窗口数不超过 max_inflight，以免长音频把队列占满，别的任务要等它全部识别完
+    '''
+
+    def __init__(self, job_id: int, websocket=None, key=None):
+        self.job_id = job_id
+        self.websocket = websocket  # 如果给了连接，每拼接完一个窗口，就把新增的字和时间戳推送给客户端
+        self.key = key              # 如果给了断点记录的键，每拼接完一个窗口就记一次断点
+        self.reply = jobs[job_id] = asyncio.Queue()
+        self.stitcher = chunking.Stitcher(args.sample_rate)
+        self.max_inflight = num_workers * batch_size * 2
+        self.windows = []       # 已提交的窗口
+        self.results = {}       # 已识别、但还没轮到拼接的窗口结果
+        self.merged = 0         # 已拼接的窗口数
+        self.finished = 0       # 已识别的窗口数
+
+        # 有断点记录的话，恢复已拼接的结果，这些窗口不再提交
+        if key:
+            done, timestamps, tokens, progress = job_store.load(key)
+            self.stitcher.restore(timestamps, tokens, progress)
+            self.windows = [None] * done
+            self.merged = self.finished = done
+            if done: print(f'任务 {job_id} 从断点继续，已识别 {progress:.0f}s')
+
+    async def collect(self, kind, result):
+        check_reply(kind, result)
+        index, timestamps, tokens = result
+        self.results[index] = (timestamps, tokens)
+        self.finished += 1
+        while self.merged in self.results:      # 按窗口顺序拼接
+            window = self.windows[self.merged]
+            stages = {}
+            with metrics.timer(stages, 'dedup'):
+                timestamps, tokens = self.stitcher.merge(window, *self.results.pop(self.merged))
+            record_stages(self.job_id, stages)
+            self.merged += 1
+            if self.key: job_store.append(self.key, window.index, self.stitcher.progress, timestamps, tokens)
+            if self.websocket and tokens:
+                await self.websocket.send(json.dumps({'type': 'partial', 
+                                                      'timestamps': timestamps, 
+                                                      'tokens': tokens}))
+
+    async def collect_ready(self):
+        while not self.reply.empty(): await self.collect(*self.reply.get_nowait())
+
+    async def submit(self, window, chunk):
+        if window.index < len(self.windows): return     # 断点之前的窗口，已经识别过了
+        while len(self.windows) - self.finished >= self.max_inflight:
+            await self.collect(*await self.reply.get())
+        enqueue('chunk', self.job_id, (window.index, chunk))
+        self.windows.append(window)
+
+    async def finish(self):
+        '''等待剩下的窗口识别完成，再交给识别进程加标点、转数字'''
+        try:
+            while self.merged < len(self.windows):
+                await self.collect(*await self.reply.get())
+            enqueue('text', self.job_id, (self.stitcher.timestamps, self.stitcher.tokens))
+            kind, message = await self.reply.get()
+        finally:
+            jobs.pop(self.job_id, None)
+        check_reply(kind, message)
+        return message
+
+    def close(self):
+        jobs.pop(self.job_id, None)
+        cancel(self.job_id)
+
+def stage_usage() -> tuple[float, float]:
+    '''自上次统计以来，识别进程、文本进程各自的利用率：忙碌时间之和 / (经过的时间 × 进程数)'''
+    global usage_mark
+    now, busy = time.time(), list(stage_busy)
+    last_time, last_busy = usage_mark
+    usage_mark = now, busy
+    elapsed = max(now - last_time, 1e-3)
+    asr = sum(busy[:num_workers]) - sum(last_busy[:num_workers])
+    text = sum(busy[num_workers:]) - sum(last_busy[num_workers:])
+    # 跨越统计时刻的任务，忙碌时间整个算在后一次，所以可能略超过 100%
+    return min(asr / elapsed / num_workers, 1), min(text / elapsed / num_text_workers, 1)
+
+async def recognize_split(job_id, file, key=None):
+    '''长音频：把窗口分给所有识别进程并行识别，拼接方式与 recognize() 相同'''
+    job = WindowJob(job_id, key=key)
+    try:
+        for window in split_file(file):
+            await job.submit(window, (str(file), window.start, window.end))
+    except:
+        job.close(); raise
+    return await job.finish()
+
+async def serve_stream(websocket, job_id, file, partial=False, store_key=None, link=None):
+    '''
+    流式任务：客户端先发 {"type": "start"}，收到 {"type": "accepted"} 后再陆续发送音频，最后发 {"type": "end"}
+    start 消息里的 "key" 命中了结果缓存的话，不回复 accepted，直接回复结果，其中 "audio_bytes" 是音频的字节数
+    接收途中暂存音频超出 max_buffered_mb 的话，回复繁忙，丢弃之后收到的音频，直到客户端发来 {"type": "end"}，返回 (None, 已收到的字节数)
+    这个任务本身就超出上限的话，重试也没用，回复 too_large_reply()，同样处理
+    接收途中识别出错的话，同样处理，回复 {"type": "error", "message": 出错信息}；收完音频之后出错的，抛出 RecognizeError
+    收到的音频追加写入暂存文件，每凑够一个窗口，就把它的位置交给识别进程，识别结果按窗口顺序拼接
+    如果 start 消息里有 "partial": true，每个窗口拼接完成后，就把新增的字和时间戳以
+    {"type": "partial", "timestamps": [...], "tokens": [...]} 推送给客户端，最后再发送完整结果
+    给了 store_key 的话，按它记断点，中断后客户端以同样的 "key" 重新发送，已识别过的窗口不再识别
+    给了 link 的话，记下它对应的结果，同一个文件再次发送时，收到 start 消息就能返回结果
+    '''
+    job = WindowJob(job_id, websocket if partial else None, store_key)
+    splitter = make_splitter(file)
+    hasher = result_cache.hasher()
+    received = 0            # 收到的总字节数
+
+    try:
+        with open(file, 'wb') as f:
+            while True:
+                data = await websocket.recv()
+                if isinstance(data, str): break         # {"type": "end"}，音频发完了
+                f.write(data); f.flush()
+                hasher.update(data)
+                received += len(data)
+                job_bytes[job_id] = received
+                if received > max_buffered_mb * 1024**2:
+                    print(f'任务 {job_id} 的音频超出暂存上限，不再接收')
+                    jobs_total.inc(label_value='too_large')
+                    await reject(websocket, job, too_large_reply())
+                    return None, received
+                if buffered_bytes() > max_buffered_mb * 1024**2:
+                    print(f'任务 {job_id} 暂存音频超出上限，回复繁忙')
+                    jobs_total.inc(label_value='busy')
+                    await reject(websocket, job, busy_reply())
+                    return None, received
+                try:
+                    for window in splitter.feed(received):
+                        await job.submit(window, (str(file), window.start, window.end))
+                    await job.collect_ready()
+                except RecognizeError as e:
+                    print(f'任务 {job_id} 出错：{e}')
+                    jobs_total.inc(label_value='error')
+                    await reject(websocket, job, {'type': 'error', 'message': str(e)})
+                    return None, received
+
+        # 音频发完了，才能算出哈希，如果有缓存，剩下的窗口就不用等了
+        key = hasher.hexdigest()
+        message = result_cache.get(key)
+        if message is not None:
+            job.close()
+            await cache_result(key, None, link, received)
+            return message, received
+
+        for window in splitter.finish(received):
+            await job.submit(window, (str(file), window.start, window.end))
+    except:
+        job.close(); raise
+    message = await job.finish()
+    await cache_result(key, message, link, received)
+    return message, received
+
+async def reject(websocket, job: WindowJob, reply: dict):
+    '''接收途中回复客户端不再接收，丢弃之后收到的音频，直到客户端发来 {"type": "end"}'''
+    await websocket.send(json.dumps(reply))
+    while not isinstance(await websocket.recv(), str): ...
+    job.close()
+
+async def cache_result(key: str, message: dict | None, link: str = None, audio_bytes: int = 0):
+    '''结果存入缓存，给了 link 的话，记下它对应的结果；写入出错只打印，结果照常发给客户端'''
+    try:
+        if message is not None: await asyncio.to_thread(result_cache.put, key, message)
+        if link: await asyncio.to_thread(result_cache.link, link, key, audio_bytes)
+    except Exception as e:
+        print(f'结果缓存写入失败：{e}')
+
+def stream_key(request: dict) -> str | None:
+    '''客户端在 start 消息里给的 "key"（文件路径、大小、修改时间），带上模型与分段配置算出哈希'''
+    if not request.get('key'): return None
+    hasher = result_cache.hasher()
+    hasher.update(str(request['key']).encode('utf-8'))
+    return hasher.hexdigest()
+
+def checkpoint_key(request: dict, key: str | None) -> str | None:
+    '''
+    断点记录的键：整段发送的用音频哈希，流式发送的用 stream_key，
+    都带上模型与分段配置，换了配置的旧断点不会被误用
+    同一个键已经有任务在识别时，不记断点，以免两个任务写乱同一份记录
+    '''
+    if key is None: key = stream_key(request)
+    if key is None or key in active_keys: return None
+    return key
+
+def buffered_bytes() -> int:
+    '''排队和识别中的任务，暂存音频的总字节数'''
+    return sum(job_bytes.values())
+
+def admit(size: int) -> bool:
+    '''判断能否再接收一个暂存音频为 size 字节的任务'''
+    if active_jobs >= max_queued_jobs: return False
+    if buffered_bytes() + size > max_buffered_mb * 1024**2: return False
+    return True
+
+def busy_reply() -> dict:
+    '''繁忙时的回复，按排队中的音频总时长和近期 RTF 估算多久之后再试'''
+    queued_seconds = buffered_bytes() / args.sample_rate / 2
+    retry_after = math.ceil(min(max(queued_seconds * recent_rtf / num_workers, 1), 60))
+    return {'type': 'busy', 'retry_after': retry_after, 'queued_jobs': active_jobs}
+
+def too_large_reply() -> dict:
+    '''单个任务的音频就超出了暂存上限，客户端不必重试'''
+    return {'type': 'too_large', 'max_bytes': max_buffered_mb * 1024**2, 
+            'message': f'音频超出服务端的暂存上限 {max_buffered_mb}MB'}
 
 async def ws_serve(websocket, path):
     global loop
-    global message
-    global queue_in, queue_out
+    global queue_in
+    global active_jobs, recent_rtf
 
     console.print(f'接客了：{websocket}', style='yellow')
 
     try:
         async for data in websocket:
-            duration_audio = len(data) / args.sample_rate / 2
-            print(f'收到音频，时长 {duration_audio:.1f}s，开始识别'); t1 = time.time()
-
-            # 阻塞型任务，在另一进程处理
-            queue_in.put(data)
-            message = await asyncio.to_thread(queue_out.get)
+            job_id = next(job_counter); t1 = time.time()
+            file = audio_dir / f'{job_id}.pcm'      # 音频暂存文件，识别进程只拿到它的路径
+            request, key, link, cached = {}, None, None, None
+            if isinstance(data, str):
+                request = json.loads(data)
+                if request.get('type') != 'start': continue
+                link = stream_key(request)
+                hit = await asyncio.to_thread(result_cache.get_linked, link) if link else None
+                if hit is not None:
+                    # 同一个文件识别过，不必再发送音频，直接回复结果
+                    cached, audio_bytes = hit
+                    cached = {**cached, 'audio_bytes': audio_bytes}
+                    duration_audio = audio_bytes / args.sample_rate / 2
+                    print(f'任务 {job_id} 按文件键命中结果缓存')
+                elif not admit(0):
+                    # 繁忙，立即回复，客户端收到后不会再发送音频
+                    print(f'任务 {job_id} 超出排队上限，回复繁忙')
+                    jobs_total.inc(label_value='busy')
+                    await websocket.send(json.dumps(busy_reply()))
+                    continue
+                else:
+                    await websocket.send(json.dumps({'type': 'accepted'}))     # 客户端收到后才开始发送音频
+            else:
+                duration_audio = len(data) / args.sample_rate / 2
+                print(f'收到音频，任务 {job_id}，时长 {duration_audio:.1f}s')
+                key = await asyncio.to_thread(result_cache.key, data)
+                cached = result_cache.get(key)
+                if cached is None and len(data) > max_buffered_mb * 1024**2:
+                    print(f'任务 {job_id} 的音频超出暂存上限，不予识别')
+                    jobs_total.inc(label_value='too_large')
+                    await websocket.send(json.dumps(too_large_reply()))
+                    continue
+                if cached is None and not admit(len(data)):
+                    print(f'任务 {job_id} 超出排队上限，回复繁忙')
+                    jobs_total.inc(label_value='busy')
+                    await websocket.send(json.dumps(busy_reply()))
+                    continue
+
+            async def run():
+                nonlocal data
+                if cached is not None: return cached, duration_audio
+                if isinstance(data, str):
+                    print(f'开始接收流式音频，任务 {job_id}，边接收边识别')
+                    message, received = await serve_stream(websocket, job_id, file, request.get('partial', False), store_key, link)
+                    if message is None: return None, 0      # 接收途中超出暂存上限或出错，已回复客户端
+                    print(f'任务 {job_id} 音频接收完毕，时长 {received / args.sample_rate / 2:.1f}s')
+                    if store_key: job_store.remove(store_key)
+                    return message, received / args.sample_rate / 2
+                job_bytes[job_id] = len(data)
+                await asyncio.to_thread(file.write_bytes, data)
+                data = None         # 已写入暂存文件，不必再占内存
+
+                # 阻塞型任务，在识别进程池中处理，结果由分发线程按任务 id 送回
+                # 长音频拆成窗口，分给多个识别进程；短音频整个交给一个识别进程
+                print(f'任务 {job_id} 开始识别')
+                if num_workers > 1 and duration_audio > split_seconds:
+                    message = await recognize_split(job_id, file, store_key)
+                else:
+                    stitched = await submit('recognize', job_id, (str(file), store_key))
+                    message = await submit('text', job_id, stitched)
+                await cache_result(key, message)
+                if store_key: job_store.remove(store_key)
+                return message, duration_audio
+
+            store_key = checkpoint_key(request, key) if cached is None else None
+            if store_key: active_keys.add(store_key)
+            if trace_dir: job_traces[job_id] = []
+            active_jobs += 1
+            cancel_flags[job_id % len(cancel_flags)] = 0
+            try:
+                # 客户端中途断开的话，取消任务，不再占用识别进程
+                result = await until_closed(websocket, asyncio.create_task(run()))
+            except RecognizeError as e:
+                # 识别进程照常工作，只是这个任务没有结果，告诉客户端，接着服务这个连接
+                print(f'任务 {job_id} 出错：{e}')
+                jobs_total.inc(label_value='error')
+                await websocket.send(json.dumps({'type': 'error', 'message': str(e)}))
+                result = None, 0
+            finally:
+                cancel(job_id)
+                active_keys.discard(store_key)
+                active_jobs -= 1
+                job_bytes.pop(job_id, None)
+                started, queued = job_started.pop(job_id, None), job_queued.pop(job_id, None)
+                file.unlink(missing_ok=True)
+            if result is None:
+                jobs_total.inc(label_value='cancelled'); job_traces.pop(job_id, None)
+                console.print(f'连接已断开，任务 {job_id} 已取消'); break
+            message, duration_audio = result
+            if message is None:
+                job_traces.pop(job_id, None); continue
             duration_recognize = time.time()-t1
+            queue_wait = started - queued if started else 0
+            if started: record_stages(job_id, {'queue_wait': [(queued, queue_wait)]})
+            if started: recent_rtf = recent_rtf * 0.8 + duration_recognize / max(duration_audio, 1e-3) * 0.2
 
-            print(f'时间戳、分词结果已返回，合并文本：\n    {message["text"]}')
+            print(f'任务 {job_id} 时间戳、分词结果已返回，合并文本：\n    {message["text"]}')
+            print(f'排队等待：{queue_wait:.1f}s')
             print(f'识别耗时：{duration_recognize:.1f}s')
-            print(f'RTF：{duration_recognize / duration_audio:.3f}')
-            await websocket.send(json.dumps(message))
+            print(f'RTF：{duration_recognize / max(duration_audio, 1e-3):.3f}')
+            print(f'结果缓存：命中 {result_cache.hits} 次，未命中 {result_cache.misses} 次')
+            print('利用率：识别进程 {:.0%}，文本进程 {:.0%}'.format(*stage_usage()))
+            stages = {}
+            with metrics.timer(stages, 'send'):
+                await websocket.send(json.dumps({'type': 'result', 'queue_wait': queue_wait, **message}))
+            record_stages(job_id, stages)
+            jobs_total.inc(label_value='done')
+            job_seconds.observe(time.time() - t1)
+            audio_seconds_total.inc(duration_audio)
+            if trace_dir: write_trace(job_id, duration_audio)
 
     except websockets.ConnectionClosed:
         console.print("ConnectionClosed...", )
@@ -241,17 +873,89 @@ async def ws_serve(websocket, path):
 async def main():
     global args, punc_model_dir
     global loop; loop = asyncio.get_event_loop()
-    global queue_in, queue_out
+    global queue_in, queue_out, queue_text
+    global stage_busy, usage_mark
+    global jobs, job_counter, job_queued, job_started, job_bytes
+    global cancel_flags
+    global active_jobs, recent_rtf
+    global result_cache
+    global job_store, active_keys
+    global job_traces
 
     # 显示欢迎信息
     splash()
 
-    # 识别部分是阻塞的，在子进程中执行，用两个队列传递消息
+    # 识别结果缓存，键里包含模型文件和分段配置，换了模型或配置，旧缓存自然失效
+    result_cache = ResultCache(cache_dir, cache_max_mb * 1024**2, {
+        'paraformer': args.paraformer, 
+        'paraformer_mtime': paraformer_path.stat().st_mtime, 
+        'tokens': args.tokens, 
+        'punc_model': str(punc_model_dir), 
+        'punc_window': punc_window, 
+        'punc_context': punc_context, 
+        'decoding_method': args.decoding_method, 
+        'chunk_mode': chunk_mode, 
+        'chunk_seconds': chunk_seconds, 
+        'overlap_seconds': overlap_seconds, 
+        'silence_seconds': (silence_min_seconds, silence_max_seconds), })
+
+    # 断点记录不随重启清空，中断的任务再次提交时可以接着识别
+    job_store = JobStore(checkpoint_dir)
+    job_store.clean(checkpoint_max_days)
+    active_keys = set()                 # 正在识别的任务的断点记录键
+
+    # 清空上次运行留下的音频暂存文件
+    shutil.rmtree(audio_dir, ignore_errors=True)
+    audio_dir.mkdir(parents=True, exist_ok=True)
+
+    # 按实测结果设置线程数和识别进程数，要在创建与进程数有关的共享数组之前
+    if auto_tune or '--calibrate' in sys.argv: tune()
+
+    # 识别部分是阻塞的，在多个子进程中执行
+    # 所有识别进程共用一个任务队列、一个结果队列，结果带有任务 id，由分发线程送回对应的连接
     queue_in = Queue()
     queue_out = Queue()
-    recognize_process = Process(target=init_recognizer, args=(queue_in, queue_out), daemon=True)
-    recognize_process.start()
-    queue_out.get() # 等待新进程加载完成
+    queue_text = Queue()                # 拼接好的识别结果，交给文本进程加标点
+    jobs = {}                           # 任务 id → 该任务的回复队列
+    job_queued = {}                     # 任务 id → 第一次放进识别队列的时间
+    job_started = {}                    # 任务 id → 第一次被识别进程取到的时间
+    job_bytes = {}                      # 任务 id → 暂存音频的字节数
+    job_traces = {}                     # 任务 id → 各阶段的 (阶段, 开始时间, 耗时)，只在开启 trace 时记录
+    cancel_flags = RawArray('b', 65536) # 与识别进程共享，按 任务 id % 长度 标记任务是否已取消
+    active_jobs = 0                     # 排队和识别中的任务数
+    recent_rtf = 0.05                   # 近期任务的 RTF，用于估算繁忙时多久之后再试
+    job_counter = itertools.count()
+    stage_busy = RawArray('d', num_workers + num_text_workers)  # 与各进程共享，记录每个进程累计的忙碌秒数
+    usage_mark = time.time(), list(stage_busy)
+
+    # 共享模式下，主进程先载入语音模型，fork 出的识别进程共享这份权重（写时复制），不必各自再载入一遍
+    # 这时还没有启动别的线程，fork 是安全的
+    context = multiprocessing
+    shared = share_models and args.num_threads == 1 and 'fork' in multiprocessing.get_all_start_methods()
+    if shared: context = multiprocessing.get_context('fork')
+
+    # 文本进程用不到语音模型，在主进程载入语音模型之前就启动，标点模型与语音模型同时载入，不等它载入完就开始服务
+    # 文本进程的忙碌统计接在识别进程后面，识别进程数可能是自动选择的，所以位置由主进程算好传过去
+    for worker_id in range(num_text_workers):
+        text_process = context.Process(target=init_text_worker, args=(worker_id, queue_text, queue_out, cancel_flags, stage_busy, num_workers + worker_id), daemon=True)
+        text_process.start()
+
+    if shared: load_asr_model('主进程')
+    for worker_id in range(num_workers):
+        recognize_process = context.Process(target=init_recognizer, args=(worker_id, queue_in, queue_out, cancel_flags, stage_busy, args.num_threads), daemon=True)
+        recognize_process.start()
+    for _ in range(num_workers): 
+        queue_out.get() # 等待各个识别进程加载完成
+    threading.Thread(target=dispatch_results, args=(queue_out,), daemon=True).start()
+
+    # 运行统计和 trace
+    if metrics_port:
+        try:
+            metrics.serve(registry, metrics_addr, metrics_port)
+            console.print(f'运行统计：[cyan underline]http://{metrics_addr}:{metrics_port}/metrics', end='\n\n')
+        except OSError as e:
+            console.print(f'运行统计端口打开失败：{e}', style='bright_red')
+    if trace_dir: trace_dir.mkdir(parents=True, exist_ok=True)
 
     console.rule('[green3]开始服务'); console.line()
     start_server = websockets.serve(ws_serve, 
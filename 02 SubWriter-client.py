@@ -26,7 +26,9 @@ with console.status("载入模块中…", spinner="bouncingBall", spinner_style=
     import wave
     import asyncio
     import subprocess
+    from datetime import timedelta
 
+    import srt
     import typer
     import websockets
 
@@ -41,62 +43,184 @@ console.print('[green4]模块加载完成', end='\n\n')
 addr = '127.0.0.1'          # Server 地址
 port = '6008'               # Server 端口
 
+frame_bytes = 16000 * 2 * 2 # 流式发送时，每次发送多少字节的音频（2 秒）
+
+max_jobs = 4                # 批量处理多个文件时，最多同时有几个文件在服务端识别（各用一个连接）
+max_decoders = 4            # 批量处理多个文件时，最多同时运行几个 ffmpeg，多出的连接等有空位再解码发送
+
 # ========================================================================
 
 
+def get_ffmpeg_cmd(file: Path) -> list:
+    ffmpeg_cmd = [
+        "ffmpeg",
+        "-i", file,
+        "-f", "s16le",
+        "-acodec", "pcm_s16le",
+        "-ac", "1",
+        "-ar", "16000",
+        "-",
+        ]
+    return ffmpeg_cmd
 
-async def main(files: list[Path]):
-    websocket = await websockets.connect(f"ws://{addr}:{port}", max_size=None, 
-                                         close_timeout=1)
 
-    for file in files:
-        print(f'\n处理文件：{file}')
-        srt_filename = Path(file).with_suffix(".srt")
-        json_filename = Path(file).with_suffix(".json")
-        txt_filename = Path(file).with_suffix(".txt")
-        merge_filename = Path(file).with_suffix(".merge.txt")
-
-        ffmpeg_cmd = [
-            "ffmpeg",
-            "-i", file,
-            "-f", "s16le",
-            "-acodec", "pcm_s16le",
-            "-ac", "1",
-            "-ar", "16000",
-            "-",
-            ]
-        process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-        data = process.stdout.read()
-        audio_duration = len(data)/2/16000
+def resume_key(file: Path) -> str:
+    '''同一个文件（路径、大小、修改时间都不变）每次都得到同一个键，服务端据此从断点接着识别'''
+    stat = Path(file).stat()
+    return f'{Path(file).resolve()}|{stat.st_size}|{stat.st_mtime_ns}'
 
+
+async def send_audio(websocket, frames) -> int:
+    '''流式发送：frames 产出多少就发多少，服务端边接收边识别，返回发送的字节数'''
+    audio_bytes = 0
+    async for data in frames:
         await websocket.send(data)
-        print(f'音频长度：{audio_duration:.1f}s'); t1 = time.time(); del data
-        message = await websocket.recv()
-        message = json.loads(message)
-        text_merge = message['text']
-        text_split = re.sub('[，。？]', '\n', text_merge)
-        timestamps = message['timestamps']
-        tokens = message['tokens']
-
-        with open(merge_filename, "w", encoding="utf-8") as f:
-            f.write(text_merge)
-        with open(txt_filename, "w", encoding="utf-8") as f:
-            f.write(text_split)
-        with open(json_filename, "w", encoding="utf-8") as f:
-            json.dump({'timestamps': timestamps, 'tokens': tokens}, f, ensure_ascii=False)
-        srt_from_txt.one_task(txt_filename)
-        procss_duration = time.time()-t1
-        print(f'处理耗时：{procss_duration:.2f}s\nRTF：{procss_duration/audio_duration:.2f}')
-    
+        audio_bytes += len(data)
+    await websocket.send(json.dumps({'type': 'end'}))
+    return audio_bytes
 
 
+async def ffmpeg_frames(file: Path):
+    '''边解码边产出音频帧'''
+    process = subprocess.Popen(get_ffmpeg_cmd(file), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while data := await asyncio.to_thread(process.stdout.read, frame_bytes):
+            yield data
+    finally:
+        process.kill()      # 服务端中途回复繁忙时，不再解码
 
 
+async def receive_result(websocket) -> dict:
+    # 开启 partial 时，服务端每识别完一段就先推送这一段的字，最后才发送带标点的完整结果
+    while True:
+        message = await websocket.recv()
+        message = json.loads(message)
+        if message.get('type') != 'partial': break
+        text = ' '.join(message['tokens']).replace('@@ ', '')
+        print(f'[{message["timestamps"][0]:.1f}s] {text}')
+    return message
+
+
+async def recognize(websocket, get_frames, partial: bool, key: str = None) -> tuple[int, dict]:
+    '''
+    先问服务端是否接收，接收了才发送音频，边发送边接收结果，服务端繁忙时，按它建议的时间等待后重新发送
+    发送途中服务端回复繁忙（暂存的音频超出上限），就停止发送
+    同一个文件识别过的话，服务端按 key 直接回复结果，不必发送音频
+    服务端识别出错，或音频超出服务端的暂存上限（重试也没用）的话，停止发送，
+    返回 {"type": "error" 或 "too_large", "message": 原因}，由调用方跳过这个文件
+    '''
+    while True:
+        await websocket.send(json.dumps({'type': 'start', 'partial': partial, 'key': key}))
+        message = json.loads(await websocket.recv())
+        if message.get('type') == 'result': return message['audio_bytes'], message
+        if message.get('type') == 'accepted':
+            sending = asyncio.create_task(send_audio(websocket, get_frames()))
+            message = await receive_result(websocket)
+            if message.get('type') not in ('busy', 'error', 'too_large'): return await sending, message
+            sending.cancel()
+            await asyncio.gather(sending, return_exceptions=True)
+            await websocket.send(json.dumps({'type': 'end'}))
+        if message.get('type') in ('error', 'too_large'): return 0, message
+        print(f'服务端繁忙，排队任务 {message["queued_jobs"]} 个，{message["retry_after"]} 秒后重试')
+        await asyncio.sleep(message['retry_after'])
+
+
+def write_result(file: Path, message: dict):
+    '''写入 4 个结果文件'''
+    json_filename = Path(file).with_suffix(".json")
+    txt_filename = Path(file).with_suffix(".txt")
+    merge_filename = Path(file).with_suffix(".merge.txt")
+
+    text_merge = message['text']
+    text_split = re.sub('[，。？]', '\n', text_merge)
+    timestamps = message['timestamps']
+    tokens = message['tokens']
+
+    with open(merge_filename, "w", encoding="utf-8") as f:
+        f.write(text_merge)
+    with open(txt_filename, "w", encoding="utf-8") as f:
+        f.write(text_split)
+    with open(json_filename, "w", encoding="utf-8") as f:
+        json.dump({'timestamps': timestamps, 'tokens': tokens}, f, ensure_ascii=False)
+
+    # 服务端已经按标点分好句、算好时间的，直接写入 srt，否则按 txt 的分行与字级时间戳匹配
+    if 'segments' not in message:
+        srt_from_txt.one_task(txt_filename); return
+    subtitles = [srt.Subtitle(index=index, 
+                              content=segment['text'], 
+                              start=timedelta(seconds=segment['start']), 
+                              end=timedelta(seconds=segment['start'] + segment['duration']))
+                 for index, segment in enumerate(message['segments'], start=1)]
+    with open(Path(file).with_suffix(".srt"), "w", encoding="utf-8") as f:
+        f.write(srt.compose(subtitles))
+
+
+async def main(files: list[Path], partial: bool = False):
+    '''逐个处理文件，ffmpeg 解码出的音频直接流式发送'''
+    websocket = await websockets.connect(f"ws://{addr}:{port}", max_size=None, 
+                                         close_timeout=1)
+
+    for file in files:
+        print(f'\n处理文件：{file}'); t1 = time.time()
+        audio_bytes, message = await recognize(websocket, lambda: ffmpeg_frames(file), partial, resume_key(file))
+        if message.get('type') != 'result':
+            print(f'跳过这个文件：{message["message"]}'); continue
+        audio_duration = audio_bytes/2/16000
+        print(f'音频长度：{audio_duration:.1f}s')
+        write_result(file, message)
+        procss_duration = time.time()-t1
+        print(f'处理耗时：{procss_duration:.2f}s\nRTF：{procss_duration/audio_duration:.2f}')
 
 
-def init(files: list[Path]):
+async def main_batch(files: list[Path], partial: bool, jobs: int, decoders: int):
+    '''
+    流水线批量处理：
+        jobs 个连接同时从文件队列取文件，各自边用 ffmpeg 解码边流式发给服务端识别，不在内存里存整个文件的音频
+        同时运行的 ffmpeg 不超过 decoders 个
+        结果文件的写入、srt 的生成在线程中进行，不耽误下一个文件的发送
+    '''
+    t1 = time.time()
+    file_queue = asyncio.Queue()
+    for file in files: file_queue.put_nowait(file)
+    decoding = asyncio.Semaphore(decoders)
+    writers = []
+    total_duration = 0
+
+    async def limited_frames(file: Path):
+        async with decoding:
+            async for data in ffmpeg_frames(file):
+                yield data
+
+    async def sender():
+        nonlocal total_duration
+        websocket = await websockets.connect(f"ws://{addr}:{port}", max_size=None, 
+                                             close_timeout=1)
+        while not file_queue.empty():
+            file = file_queue.get_nowait(); t2 = time.time()
+            audio_bytes, message = await recognize(websocket, lambda: limited_frames(file), partial, resume_key(file))
+            if message.get('type') != 'result':
+                print(f'跳过：{file}，{message["message"]}'); continue
+            audio_duration = audio_bytes / 2 / 16000
+            writers.append(asyncio.create_task(asyncio.to_thread(write_result, file, message)))
+            total_duration += audio_duration
+            print(f'完成：{file}，音频长度：{audio_duration:.1f}s，耗时：{time.time() - t2:.2f}s')
+        await websocket.close()
+
+    sender_tasks = [asyncio.create_task(sender()) for _ in range(min(jobs, len(files)))]
+    await asyncio.gather(*sender_tasks)
+    await asyncio.gather(*writers)
+
+    procss_duration = time.time()-t1
+    print(f'\n共 {len(files)} 个文件，音频总长度：{total_duration:.1f}s')
+    print(f'处理耗时：{procss_duration:.2f}s\nRTF：{procss_duration/max(total_duration, 1e-3):.2f}')
+
+
+def init(files: list[Path], partial: bool = False, jobs: int = max_jobs, decoders: int = max_decoders):
     # try:
-    asyncio.run(main(files))
+    if len(files) > 1 and jobs > 1:
+        asyncio.run(main_batch(files, partial, jobs, decoders))
+    else:
+        asyncio.run(main(files, partial))
     # except KeyboardInterrupt:
     #     console.print(f'再见！')
     #     sys.exit()
@@ -0,0 +1,563 @@
+# coding: utf-8
+'''
+性能测试脚本，在本机直接载入服务端的识别流程，不经过 websocket
+
+    python "03 SubWriter-bench.py" batch 音频文件 --batch-sizes 1 --batch-sizes 4
+
+    python "03 SubWriter-bench.py" chunk 音频文件
+    python "03 SubWriter-bench.py" srt --tokens 20000
+    python "03 SubWriter-bench.py" words --tokens 500000
+    python "03 SubWriter-bench.py" itn --lines 50000
+    python "03 SubWriter-bench.py" space --lines 200000
+    python "03 SubWriter-bench.py" suite --minutes 1 --minutes 60 --cost 0.002
+
+batch：比较逐段串行解码与批量解码（decode_streams）的耗时和 RTF
+chunk：比较固定长度切分与停顿处切分的耗时、重复识别的比例，以及识别结果的差异
+srt：用随机生成的字幕稿和随机的修改，比较 srt_from_txt 两种匹配方式的耗时和时间轴的准确率
+words：比较从 json 读出每个分词一个 dict，与读取 .words.npy 的耗时和内存占用
+itn：对照 chinese_itn 一次匹配判断类型的做法与原来依次尝试各个模式的做法，结果应完全相同，并比较耗时
+space：对照 format_tools.adjust_space 缓存替换结果的做法与原来每次都做替换的做法，结果应完全相同，并比较耗时
+suite：不需要模型文件，用假的识别器和标点模型、生成的音频，跑一遍完整流程，
+       报告各阶段耗时、RTF、吞吐量和内存峰值，可以放在 CI 里发现某个阶段变慢
+'''
+
+import sys
+from os import path
+
+if 'BASE_DIR' not in globals():
+    BASE_DIR = path.dirname(path.abspath(__file__))
+
+from rich.console import Console
+console = Console(highlight=False)
+
+import time
+import json
+import random
+import tracemalloc
+import re
+import difflib
+import signal
+import shutil
+import asyncio
+import tempfile
+import subprocess
+import importlib.util
+from pathlib import Path
+
+import typer
+import numpy as np
+
+app = typer.Typer()
+
+
+def load_server():
+    '''把服务端脚本当作模块载入，以便直接调用其中的 recognize 等函数'''
+    spec = importlib.util.spec_from_file_location('subwriter_server', path.join(BASE_DIR, '01 SubWriter-server.py'))
+    server = importlib.util.module_from_spec(spec)
+    server.BASE_DIR = BASE_DIR
+    spec.loader.exec_module(server)
+    return server
+
+
+def read_audio(file: Path) -> Path:
+    '''用 ffmpeg 把音视频转为 16k 单声道 16bit 的 pcm，存入临时文件，返回其路径'''
+    pcm_file = Path(tempfile.mkdtemp()) / 'audio.pcm'
+    ffmpeg_cmd = [
+        "ffmpeg",
+        "-i", file,
+        "-f", "s16le",
+        "-acodec", "pcm_s16le",
+        "-ac", "1",
+        "-ar", "16000",
+        "-y", pcm_file,
+        ]
+    subprocess.run(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return pcm_file
+
+
+@app.command()
+def batch(file: Path, batch_sizes: list[int] = [1, 2, 4, 8], rounds: int = 1):
+    '''比较不同 batch_size 下 recognize() 的耗时，batch_size=1 即原来的逐段串行解码'''
+    server = load_server()
+    server.load_models()
+    pcm_file = read_audio(file)
+    duration_audio = pcm_file.stat().st_size / server.args.sample_rate / 2
+    console.print(f'音频长度：{duration_audio:.1f}s', end='\n\n')
+
+    reference = None
+    for batch_size in batch_sizes:
+        server.batch_size = batch_size
+        durations = []
+        for _ in range(rounds):
+            t1 = time.time()
+            timestamps, tokens = server.recognize(str(pcm_file))
+            durations.append(time.time() - t1)
+        duration = min(durations)
+        if reference is None: reference = tokens
+        same = '一致' if tokens == reference else '不一致'
+        print(f'\rbatch_size={batch_size:<3} 耗时：{duration:.2f}s  RTF：{duration / duration_audio:.4f}  '
+              f'与首个配置的识别结果{same}')
+
+
+@app.command()
+def chunk(file: Path, modes: list[str] = ['fixed', 'silence'], rounds: int = 1):
+    '''比较不同 chunk_mode 下 recognize() 的耗时，重叠部分要识别两遍，重复识别的比例越低越省'''
+    server = load_server()
+    server.load_models()
+    pcm_file = read_audio(file)
+    duration_audio = pcm_file.stat().st_size / server.args.sample_rate / 2
+    console.print(f'音频长度：{duration_audio:.1f}s', end='\n\n')
+
+    reference = None
+    for mode in modes:
+        server.chunk_mode = mode
+        windows = server.split_file(str(pcm_file))
+        duration_decode = sum(window.end - window.start for window in windows) / server.args.sample_rate / 2
+        pauses = sum(1 for window in windows if not window.is_last and not window.tail)
+        durations = []
+        for _ in range(rounds):
+            t1 = time.time()
+            timestamps, tokens = server.recognize(str(pcm_file))
+            durations.append(time.time() - t1)
+        duration = min(durations)
+        if reference is None: reference = tokens
+        similarity = difflib.SequenceMatcher(None, reference, tokens, autojunk=False).ratio()
+        print(f'\r{mode:<8} 窗口数：{len(windows)}  在停顿处切开：{pauses}  '
+              f'重复识别：{duration_decode / duration_audio - 1:.1%}  '
+              f'耗时：{duration:.2f}s  RTF：{duration / duration_audio:.4f}  '
+              f'与首个配置的识别结果相似度：{similarity:.2%}')
+
+
+def fake_transcript(num_tokens: int, seed: int = 0):
+    '''随机生成分词、分行的字幕稿，以及每行真实的起始时间'''
+    from util import srt_from_txt
+    rng = random.Random(seed)
+    chars = [chr(0x4e00 + i) for i in range(300)]      # 常用字不多，同一个字会反复出现
+    tokens = [rng.choice(chars) for _ in range(num_tokens)]
+    timestamps = [i * 0.25 for i in range(num_tokens)]
+    lines, starts = [], []
+    i = 0
+    while i < num_tokens:
+        n = rng.randint(5, 20)
+        lines.append(''.join(tokens[i : i + n]))
+        starts.append(timestamps[i])
+        i += n
+    return srt_from_txt.make_words(timestamps, tokens), lines, starts
+
+
+def edit_lines(lines: list[str], starts: list[float], rate: float, seed: int = 0, 
+               passages: int = 0, passage_lines: int = 10):
+    '''模拟用户的修改：改错字、删字、加字、加标点，偶尔删掉整行，另外删掉 passages 段连续 passage_lines 行（跑题的一段）'''
+    rng = random.Random(seed)
+    deleted = set()
+    for _ in range(passages):
+        first = rng.randrange(max(len(lines) - passage_lines, 1))
+        deleted.update(range(first, first + passage_lines))
+    edited, edited_starts = [], []
+    for index, (line, start) in enumerate(zip(lines, starts)):
+        if index in deleted: continue
+        if rng.random() < rate / 5: continue
+        chars = []
+        for char in line:
+            r = rng.random()
+            if r < rate: chars.append(chr(0x9000 + rng.randrange(100)))   # 改错字
+            elif r < rate * 1.5: continue                                   # 删字
+            else: chars.append(char)
+            if rng.random() < rate / 2: chars.append(chr(0x9000 + rng.randrange(100)))  # 加字
+            if rng.random() < 0.05: chars.append('，')
+        if not chars: continue
+        edited.append(''.join(chars) + '\n'); edited_starts.append(start)
+    return edited, edited_starts
+
+
+@app.command()
+def srt(tokens: int = 20000, rate: float = 0.05, tolerance: float = 0.5, passages: int = 3, passage_lines: int = 10):
+    '''比较 srt_from_txt 的逐行贪心匹配与整篇对齐：耗时，以及起始时间误差在 tolerance 秒以内的行的比例
+    分别测只有零散修改的，和另外删掉了 passages 段、每段连续 passage_lines 行的'''
+    sys.path.insert(0, BASE_DIR)
+    from util import srt_from_txt
+
+    words, lines, starts = fake_transcript(tokens)
+    for deleted in (0, passages):
+        edited, edited_starts = edit_lines(lines, starts, rate, passages=deleted, passage_lines=passage_lines)
+        console.print(f'分词数：{len(words)}  行数：{len(edited)}  修改比例：{rate:.0%}  删掉的整段：{deleted} × {passage_lines} 行')
+
+        for name, match in (('greedy', srt_from_txt.lines_match_words), ('align', srt_from_txt.lines_align_words)):
+            t1 = time.time()
+            subtitles = match(edited, words)
+            duration = time.time() - t1
+            correct = sum(1 for subtitle, start in zip(subtitles, edited_starts) 
+                          if abs(subtitle.start.total_seconds() - start) <= tolerance)
+            print(f'{name:<7} 耗时：{duration:.3f}s  时间轴准确的行：{correct / len(edited):.1%}')
+        print()
+
+
+def json_word_dicts(json_file: Path) -> list[dict]:
+    '''原来的读取方式：解析 json，每个分词一个 dict'''
+    with open(json_file, 'r', encoding='utf-8') as f:
+        json_info = json.load(f)
+    words = [{'word': token.replace('@', ''), 'start': timestamp, 'end': timestamp + 0.2} 
+             for (timestamp, token) in zip(json_info['timestamps'], json_info['tokens'])]
+    for i in range(len(words) - 1):
+        words[i]['end'] = min(words[i]['end'], words[i+1]['start'])
+    return words
+
+
+@app.command()
+def words(tokens: int = 500000):
+    '''比较读取分词的耗时和 Python 对象的内存峰值，内存映射的文件内容按需读入，不计在内'''
+    sys.path.insert(0, BASE_DIR)
+    from util import srt_from_txt
+
+    rng = random.Random(0)
+    chars = [chr(0x4e00 + i) for i in range(3000)] + [f'{chr(0x61 + i)}@@' for i in range(26)]
+    json_file = Path(tempfile.mkdtemp()) / 'audio.json'
+    with open(json_file, 'w', encoding='utf-8') as f:
+        json.dump({'timestamps': [round(i * 0.25, 2) for i in range(tokens)], 
+                   'tokens': [rng.choice(chars) for _ in range(tokens)]}, f, ensure_ascii=False)
+    console.print(f'分词数：{tokens}  json 大小：{json_file.stat().st_size / 1024**2:.1f}MB', end='\n\n')
+
+    def measure(name, load):
+        tracemalloc.start()
+        t1 = time.time()
+        result = load()
+        duration = time.time() - t1
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{name:<16} 耗时：{duration:.3f}s  内存峰值：{peak / 1024**2:.1f}MB')
+        return result
+
+    measure('json + dict', lambda: json_word_dicts(json_file))
+    measure('json + ndarray', lambda: srt_from_txt.get_words(json_file))      # 第一次，顺便生成 .words.npy
+    words = measure('.words.npy', lambda: srt_from_txt.get_words(json_file))
+    npy_file = json_file.with_suffix('.words.npy')
+    print(f'\n.words.npy 大小：{npy_file.stat().st_size / 1024**2:.1f}MB  每个分词 {words.itemsize} 字节')
+
+
+def convert_cascade(original: str) -> str:
+    '''chinese_itn 原来的做法：依次用各个细分模式尝试匹配，结果应与 chinese_itn.convert 完全相同'''
+    from util import chinese_itn as itn
+    try:
+        stripped = original.strip(itn.common_units)
+        if itn.pure_num.fullmatch(stripped): return itn.convert_pure_num(original)
+        if itn.value_num.fullmatch(stripped): return itn.convert_value_num(original)
+        if itn.percent_value.fullmatch(original): return itn.convert_percent_value(original)
+        if itn.fraction_value.fullmatch(original): return itn.convert_fraction_value(original)
+        if itn.ratio_value.fullmatch(original): return itn.convert_ratio_value(original)
+        if itn.time_value.fullmatch(original): return itn.convert_time_value(original)
+        if itn.data_value.fullmatch(original): return itn.convert_date_value(original)
+    except:
+        ...
+    return original
+
+
+def cascade_to_num(text: str) -> str:
+    '''与 chinese_itn.chinese_to_num 相同，只是每个片段用 convert_cascade 转换'''
+    from util import chinese_itn as itn
+    idiom_starts = itn.find_idioms(text)
+    def replace(match):
+        l_pos, r_pos = match.regs[2]; l_pos = max(l_pos-2, 0)
+        head, original = match.group(1), match.group(2)
+        final = original if itn.in_idiom(idiom_starts, l_pos, r_pos) else convert_cascade(original)
+        return head + final if head else final
+    return itn.pattern.sub(replace, text)
+
+
+@app.command()
+def itn(lines: int = 50000):
+    '''随机拼出大量含数字的句子，对照两种做法的结果，再比较逐行转换、缓存、多进程的耗时'''
+    sys.path.insert(0, BASE_DIR)
+    from util import chinese_itn
+
+    rng = random.Random(0)
+    pieces = list('零幺一二两三四五六七八九十百千万亿点比年月日号分之个只秒') + ['百分之', '分之', ' ', 'a', 'k', '的', '是', '乱七八糟']
+    corpus = [''.join(rng.choice(pieces) for _ in range(rng.randint(1, 12))) for _ in range(lines)]
+    corpus += ['现在是电脑是没有插电，插上电的话是零点零三', '音频三十秒六十秒、九十秒', '百分之三十五点五', 
+               '三分之二', '三比二', '十二点三十分', '二零二四年三月五号', '千万不能轻易渡人', '一百二十七秒']
+    different = [line for line in corpus if chinese_itn.chinese_to_num(line) != cascade_to_num(line)]
+    console.print(f'对照 {len(corpus)} 句，结果不同的有 {len(different)} 句 {different[:5]}', end='\n\n')
+
+    t1 = time.time(); [cascade_to_num(line) for line in corpus]
+    t2 = time.time(); chinese_itn.convert.cache_clear(); [chinese_itn.chinese_to_num(line) for line in corpus]
+    t3 = time.time(); chinese_itn.convert.cache_clear(); chinese_itn.chinese_to_num_batch(corpus)
+    t4 = time.time()
+    print(f'依次尝试：{t2 - t1:.3f}s  一次匹配并缓存：{t3 - t2:.3f}s  多进程：{t4 - t3:.3f}s')
+
+
+def legacy_replacer(original: re.Match) -> str:
+    '''format_tools 原来的替换函数：每个匹配都重新做一遍正则替换'''
+    from util.format_tools import digits
+    left : str = original.group(1)
+    center : str = original.group(2)
+    right : str = original.group(3)
+    # 如果拼写字母中间有空格，就把空格都去掉
+    if center:
+        final = re.sub(r'((\d) )?(\b\w) ?(?!\w{2})', r'\2\3', center).strip()
+
+    # 如果英文的左边有汉字或英文，给两组之间加上空格
+    if left :
+        if left.strip(digits) == left and center.lstrip(digits) == center :  # 左侧结尾不是数字，中间开头不是数字
+            final = ' ' + final
+        final = left.rstrip() + final
+
+    # 如果英文左边的汉字被前一个组消费了，就要手动去看一下前一个字是不是中文
+    elif re.match(r'[\u4e00-\u9fa5]', original.string[original.start(2) - 1]): 
+        if center.lstrip(digits) == center:     # 确保中间开头不是数字
+            final = ' ' + final
+
+    # 如果英文的右边有汉字，给中英之间加上空格
+    if right:
+        if center.rstrip(digits) == center:     # 确保中间结尾不是数字
+            final += ' '
+        final += right.lstrip()
+
+    return final
+
+
+@app.command()
+def space(lines: int = 200000):
+    '''随机拼出大量中英文、数字、空格混排的句子，对照两种做法的结果，再比较整段处理的耗时'''
+    sys.path.insert(0, BASE_DIR)
+    from util import format_tools
+
+    rng = random.Random(0)
+    pieces = list('我们用的是手机电脑') + list('abcxyzGPU') + list('0123459') + [' ', ' ', 'python', 'txt', '5g', 'srt', '，', '。']
+    corpus = [''.join(rng.choice(pieces) for _ in range(rng.randint(1, 16))) for _ in range(lines)]
+    legacy = lambda text: format_tools.en_in_zh.sub(legacy_replacer, text)
+    different = [line for line in corpus if format_tools.adjust_space(line) != legacy(line)]
+    console.print(f'对照 {len(corpus)} 句，结果不同的有 {len(different)} 句 {different[:5]}', end='\n\n')
+
+    for name, text in (('随机混排', '\n'.join(corpus)), 
+                       ('字幕', '这是 G P U 的 t x t 文件，用 python3 写的 5 g 手机，' * 20000)):
+        t1 = time.time(); legacy(text)
+        t2 = time.time(); format_tools.join_groups.cache_clear(); format_tools.adjust_space(text)
+        t3 = time.time()
+        print(f'{name}：{len(text)} 字  原来的做法：{t2 - t1:.3f}s  缓存替换结果：{t3 - t2:.3f}s')
+
+
+# ============================假模型，suite 用====================================
+
+# 假识别器的词表：音频每 0.25 秒为一块，块内的采样值就是词表中的编号，夹杂一些数字，让转数字也有事可做
+fake_vocab = list('我们今天讨论一下这个问题大家都知道时候说的是在有人') + list('一二三四五六七八九十百千万点')
+block_seconds = 0.25
+
+
+class FakeResult:
+    def __init__(self):
+        self.timestamps, self.tokens = [], []
+
+
+class FakeStream:
+    def __init__(self):
+        self.result = FakeResult()
+
+    def accept_waveform(self, sample_rate, samples):
+        self.sample_rate, self.samples = sample_rate, samples
+
+
+class FakeRecognizer:
+    '''接口与 sherpa_onnx.OfflineRecognizer 相同，每识别 1 秒音频耗时 cost 秒'''
+
+    def __init__(self, cost: float):
+        self.cost = cost
+
+    def create_stream(self):
+        return FakeStream()
+
+    def decode_stream(self, stream):
+        block = int(stream.sample_rate * block_seconds)
+        time.sleep(self.cost * len(stream.samples) / stream.sample_rate)
+        ids = np.rint(stream.samples[block // 2 :: block] * 32768).astype(int).tolist()
+        for i, id in enumerate(ids):
+            if not 0 < id <= len(fake_vocab): continue
+            stream.result.tokens.append(fake_vocab[id - 1])
+            stream.result.timestamps.append(round(i * block_seconds + 0.05, 2))
+
+    def decode_streams(self, streams):
+        for stream in streams: self.decode_stream(stream)
+
+
+class FakePunc:
+    '''接口与 funasr_onnx.CT_Transformer 相同，每 12 个字加一个逗号，每 36 个字加一个句号，每个字耗时 cost 秒'''
+
+    def __init__(self, cost: float):
+        self.cost = cost
+
+    def __call__(self, text: str):
+        time.sleep(self.cost * len(text))
+        pieces, count = [], 0
+        for char in text:
+            pieces.append(char)
+            if char.isspace(): continue
+            count += 1
+            if count % 36 == 0: pieces.append('。')
+            elif count % 12 == 0: pieces.append('，')
+        return [''.join(pieces)]
+
+
+def use_fake_models(server, cost: float, punc_cost: float, work_dir: Path):
+    '''把服务端的模型载入换成假模型，缓存、暂存、断点目录都放到 work_dir 里，不影响正式的'''
+    def load_asr_model(name):
+        server.np = np
+        server.sample_buffer = np.empty(0, dtype=np.float32)
+        server.recognizer = FakeRecognizer(cost)
+
+    def load_punc_model(worker_id=0):
+        server.punc_model = FakePunc(punc_cost)
+
+    server.load_asr_model, server.load_punc_model = load_asr_model, load_punc_model
+    server.splash = lambda: None
+    server.paraformer_path = Path(__file__)         # 只用来取修改时间，作为缓存键的一部分
+    server.audio_dir = work_dir / 'audio'
+    server.cache_dir = work_dir / 'cache'
+    server.checkpoint_dir = work_dir / 'checkpoints'
+    server.auto_tune = False                        # 用固定的线程数和进程数，不去实测，也不写 tuning.json
+
+
+def write_fake_pcm(file: Path, seconds: int, seed: int = 0):
+    '''生成假识别器能认出的音频，每次写入一分钟，3 小时的音频也不必整个放在内存里'''
+    rng = np.random.default_rng(seed)
+    block = int(16000 * block_seconds)
+    with open(file, 'wb') as f:
+        for start in range(0, seconds, 60):
+            n = int(min(60, seconds - start) / block_seconds)
+            ids = rng.integers(1, len(fake_vocab) + 1, n)
+            f.write(np.repeat(ids, block).astype(np.int16).tobytes())
+
+
+class StageTimer:
+    '''把某个模块里的函数换成计时的版本，按阶段累计耗时和调用次数'''
+
+    def __init__(self):
+        self.seconds, self.calls = {}, {}
+
+    def wrap(self, owner, name: str, stage: str):
+        function = getattr(owner, name)
+        def timed(*args, **kwargs):
+            t1 = time.perf_counter()
+            try: return function(*args, **kwargs)
+            finally:
+                self.seconds[stage] = self.seconds.get(stage, 0) + time.perf_counter() - t1
+                self.calls[stage] = self.calls.get(stage, 0) + 1
+        setattr(owner, name, timed)
+
+    def reset(self):
+        self.seconds.clear(); self.calls.clear()
+
+
+def peak_rss_mb() -> tuple[float, float]:
+    '''(本进程, 已结束的子进程中最大的) 内存峰值，单位 MB，不支持的系统返回 0'''
+    try: import resource
+    except ImportError: return 0, 0
+    scale = 1024**2 if sys.platform == 'darwin' else 1024       # macOS 上单位是字节，Linux 上是 KB
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+async def websocket_round_trip(port: int, pcm_file: Path) -> tuple[float, dict]:
+    '''按客户端的流式协议发送整个音频，返回从开始发送到收到结果的秒数'''
+    import websockets
+    for _ in range(100):        # 等服务端启动
+        try: websocket = await websockets.connect(f'ws://127.0.0.1:{port}', max_size=None); break
+        except OSError: await asyncio.sleep(0.2)
+    t1 = time.time()
+    await websocket.send(json.dumps({'type': 'start'}))
+    await websocket.recv()      # {"type": "accepted"}
+    with open(pcm_file, 'rb') as f:
+        while data := f.read(16000 * 2 * 10):
+            await websocket.send(data)
+    await websocket.send(json.dumps({'type': 'end'}))
+    message = json.loads(await websocket.recv())
+    duration = time.time() - t1
+    await websocket.close()
+    return duration, message
+
+
+@app.command(hidden=True)
+def fake_server(port: int, work_dir: Path, cost: float = 0.002, punc_cost: float = 0.0):
+    '''载入假模型的服务端，供 suite 测试 websocket 往返，识别进程要靠 fork 继承假模型'''
+    server = load_server()
+    use_fake_models(server, cost, punc_cost, work_dir)
+    server.addr, server.port = '127.0.0.1', str(port)
+    server.init()
+
+
+@app.command()
+def suite(minutes: list[int] = [1, 10, 60, 180], cost: float = 0.002, punc_cost: float = 0.00002, 
+          port: int = 6018, websocket: bool = True):
+    '''
+    用假识别器（每秒音频耗时 cost 秒）和假标点模型，对 1 分钟到 3 小时的生成音频跑一遍：
+    recognize() 的切分、解码、去重，加标点、转数字、调空格、分句，srt_from_txt 对齐，以及 websocket 往返
+    '''
+    sys.path.insert(0, BASE_DIR)
+    from util import srt_from_txt
+    work_dir = Path(tempfile.mkdtemp())
+    server = load_server()
+    use_fake_models(server, cost, punc_cost, work_dir)
+    server.load_models(); server.load_punc_model()
+
+    # 要统计耗时的各个阶段
+    timer = StageTimer()
+    timer.wrap(server, 'decode_chunks', '解码')
+    timer.wrap(server.chunking.Stitcher, 'merge', '去重拼接')
+    timer.wrap(server.punctuation, 'punctuate', '加标点')
+    timer.wrap(server.chinese_itn, 'chinese_to_num', '转数字')
+    timer.wrap(server.format_tools, 'adjust_space', '调空格')
+    timer.wrap(server.segments, 'carry', '字与分词对照')
+    timer.wrap(server.segments, 'split_segments', '分句')
+
+    # websocket 往返，另起一个载入假模型的服务端
+    process = None
+    if websocket and 'fork' in server.multiprocessing.get_all_start_methods():
+        process = subprocess.Popen([sys.executable, path.abspath(__file__), 'fake-server', str(port), str(work_dir), 
+                                    '--cost', str(cost), '--punc-cost', str(punc_cost)], 
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    console.print(f'假识别器每秒音频耗时：{cost}s  假标点模型每字耗时：{punc_cost}s', end='\n\n')
+
+    try:
+        for minute in minutes:
+            seconds = minute * 60
+            pcm_file = work_dir / f'{minute}min.pcm'
+            write_fake_pcm(pcm_file, seconds)
+            timer.reset()
+
+            t1 = time.time()
+            timestamps, tokens = server.recognize(str(pcm_file))
+            duration_recognize = time.time() - t1
+            t1 = time.time()
+            message = server.post_process(timestamps, tokens)
+            duration_text = time.time() - t1
+
+            # srt_from_txt：按客户端的方式写出 txt 和 json，再整篇对齐
+            with open(pcm_file.with_suffix('.json'), 'w', encoding='utf-8') as f:
+                json.dump({'timestamps': timestamps, 'tokens': tokens}, f, ensure_ascii=False)
+            with open(pcm_file.with_suffix('.txt'), 'w', encoding='utf-8') as f:
+                f.write(message['text'].replace('，', '\n').replace('。', '\n'))
+            t1 = time.time()
+            srt_from_txt.one_task(pcm_file)
+            duration_srt = time.time() - t1
+
+            duration_ws = None
+            if process:
+                duration_ws, _ = asyncio.run(websocket_round_trip(port, pcm_file))
+            pcm_file.unlink()
+
+            rss_self, _ = peak_rss_mb()
+            print(f'\r音频 {minute} 分钟，{len(tokens)} 个字，{len(message["segments"])} 句')
+            print(f'  识别：{duration_recognize:.2f}s  RTF：{duration_recognize / seconds:.4f}  '
+                  f'吞吐：{seconds / duration_recognize:.0f} 秒音频/秒')
+            print(f'  文本：{duration_text:.2f}s  吞吐：{len(tokens) / max(duration_text, 1e-6):.0f} 字/秒')
+            print(f'  srt：{duration_srt:.2f}s')
+            if duration_ws is not None:
+                print(f'  websocket 往返：{duration_ws:.2f}s  RTF：{duration_ws / seconds:.4f}')
+            print('  各阶段：' + '  '.join(f'{stage} {timer.seconds[stage]:.3f}s/{timer.calls[stage]}次' for stage in timer.seconds))
+            print(f'  内存峰值：{rss_self:.0f}MB')
+    finally:
+        if process:
+            process.send_signal(signal.SIGINT); process.wait()      # 服务端退出时会结束它的识别进程
+            print(f'服务端进程内存峰值：{peak_rss_mb()[1]:.0f}MB')
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    app()
@@ -11,12 +11,19 @@ from chinese_itn import chinese_to_num
 res = chinese_to_num('幺九二点幺六八点幺点幺')  
 print(res)  # 192.168.1.1
 
+大量文本可以用 chinese_to_num_batch 分给多个进程转换：
+
+results = chinese_to_num_batch(lines)
+
 '''
 
-__all__ = ['chinese_to_num']
+__all__ = ['chinese_to_num', 'chinese_to_num_batch']
 
 import re
+from bisect import bisect_left
+from functools import partial, lru_cache
 from string import ascii_letters
+from concurrent.futures import ProcessPoolExecutor
 
 
 # 常见的跟在数字后面的单位
@@ -35,6 +42,9 @@ idioms = '''
 
 idioms = [x.strip() for x in idioms.split() ]
 
+# 所有常用语合成一个模式，放在零宽的前瞻里，扫一遍文本就能找出每个常用语出现的所有位置（包括相互重叠的）
+idiom_pattern = re.compile('(?=(%s))' % '|'.join(map(re.escape, idioms))) if idioms else None
+
 # 总模式，筛选出可能需要替换的内容
 # 测试链接  https://regex101.com/r/tFqg9S/3
 pattern = re.compile(f"""(?ix)          # i 表示忽略大小写，x 表示开启注释模式
@@ -87,6 +97,21 @@ time_value = re.compile("[零一二三四五六七八九十]+点([零一二三
 data_value = re.compile("([零一二三四五六七八九]+年)?([一二三四五六七八九十]+月)([一二三四五六七八九十]+[日号])")
 
 
+# 把上面的细分模式合成一个，一次 fullmatch 就能判断类型，由 lastgroup 得知是哪一种
+# 分支的顺序即原来依次尝试的顺序，前面的分支能完整匹配，就不会再试后面的
+# 纯数字、数值要先去掉两端的单位再匹配，所以单独合成一个
+stripped_classifier = re.compile(f'(?P<pure>{pure_num.pattern})|(?P<value>{value_num.pattern})')
+classifier = re.compile(f'''(?x)
+ (?P<percent>(?<![一二三四五六七八九])百分之[零一二三四五六七八九十百千万]+(?P<percent_dot>点)?(?(percent_dot)[零一二三四五六七八九]+))
+|(?P<fraction>[零一二三四五六七八九十百千万]+(?P<fraction_dot1>点)?(?(fraction_dot1)[零一二三四五六七八九]+)
+    分之[零一二三四五六七八九十百千万]+(?P<fraction_dot2>点)?(?(fraction_dot2)[零一二三四五六七八九]+))
+|(?P<ratio>[零一二三四五六七八九十百千万]+(?P<ratio_dot1>点)?(?(ratio_dot1)[零一二三四五六七八九]+)
+    比[零一二三四五六七八九十百千万]+(?P<ratio_dot2>点)?(?(ratio_dot2)[零一二三四五六七八九]+))
+|(?P<time>{time_value.pattern})
+|(?P<date>{data_value.pattern})
+''')
+
+
 # 中文数字对阿拉伯数字的映射
 num_mapper = {
     '零': '0', 
@@ -223,48 +248,63 @@ def convert_date_value(original):
     ...
 
 
-def replace(original):
+def find_idioms(string):
+    '''返回文本中所有常用语的起始位置，升序排列'''
+    if not idiom_pattern: return []
+    return [m.start() for m in idiom_pattern.finditer(string)]
+
+def in_idiom(idiom_starts, l_pos, r_pos):
+    '''[l_pos, r_pos) 范围内是否有常用语开头'''
+    i = bisect_left(idiom_starts, l_pos)
+    return i < len(idiom_starts) and idiom_starts[i] < r_pos
+
+converters = {
+    'pure': convert_pure_num, 
+    'value': convert_value_num, 
+    'percent': convert_percent_value, 
+    'fraction': convert_fraction_value, 
+    'ratio': convert_ratio_value, 
+    'time': convert_time_value, 
+    'date': convert_date_value, 
+}
+
+@lru_cache(maxsize=65536)
+def convert(original):
+    '''判断类型并转换，同样的片段在长文本里会反复出现，结果缓存起来'''
+    try:
+        match = (stripped_classifier.fullmatch(original.strip(common_units)) 
+                 or classifier.fullmatch(original))
+        if not match: return original
+        return converters[match.lastgroup](original)
+    except:
+        return original
+
+def replace(original, idiom_starts=None):
     string = original.string
     l_pos, r_pos = original.regs[2]; l_pos = max(l_pos-2, 0)
     head = original.group(1)
     original = original.group(2)
-    try:
-        if idioms and any([string.find(idiom) in range(l_pos, r_pos) for idiom in idioms]):
-            final = original
-        elif pure_num.fullmatch(original.strip(common_units)):
-            num_type = '纯数字'
-            final = convert_pure_num(original)
-        elif value_num.fullmatch(original.strip(common_units)):
-            num_type = '数值'
-            final = convert_value_num(original)
-        elif percent_value.fullmatch(original):
-            num_type = '百分之数值'
-            final = convert_percent_value(original)
-        elif fraction_value.fullmatch(original):
-            num_type = '分数'
-            final = convert_fraction_value(original)
-        elif ratio_value.fullmatch(original):
-            num_type = '比值'
-            final = convert_ratio_value(original)
-        elif time_value.fullmatch(original):
-            num_type = '时间'
-            final = convert_time_value(original)
-        elif data_value.fullmatch(original):
-            num_type = '日期'
-            final = convert_date_value(original)
-        else:
-            final = original
-
-        if head:
-            final = head + final
-    except:
-        num_type = '未知'
+    if idiom_starts is None: idiom_starts = find_idioms(string)
+    if in_idiom(idiom_starts, l_pos, r_pos):
         final = original
+    else:
+        final = convert(original)
+    if head:
+        final = head + final
     return final
 
 
 def chinese_to_num(original):
-    return pattern.sub(replace, original)
+    # 常用语的位置对整段文本只找一遍，每个匹配只需二分查找
+    return pattern.sub(partial(replace, idiom_starts=find_idioms(original)), original)
+
+def chinese_to_num_batch(lines, processes=None, chunksize=64):
+    '''转换多行文本，行数多时分给 processes 个进程（默认为 CPU 核数），返回的顺序与输入相同'''
+    lines = list(lines)
+    if processes == 1 or len(lines) <= chunksize:
+        return [chinese_to_num(line) for line in lines]
+    with ProcessPoolExecutor(processes) as executor:
+        return list(executor.map(chinese_to_num, lines, chunksize=chunksize))
 
 if __name__ == "__main__":
 
@@ -296,4 +336,11 @@ if __name__ == "__main__":
     #         print(word, new)
     print(chinese_to_num(txt))
     # print(chinese_to_num('乱七八糟'))
-    
+
+    # 耗时应随文本长度线性增长
+    import time
+    for times in (1, 10, 100, 400):
+        long_txt = txt * times
+        t1 = time.time()
+        chinese_to_num(long_txt)
+        print(f'{len(long_txt):>8} 字  耗时 {time.time() - t1:.3f}s')
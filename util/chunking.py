@@ -0,0 +1,195 @@
+# coding: utf-8
+'''
+把 16bit 单声道音频切分为带重叠的识别窗口，
+再把各窗口的识别结果按顺序拼接起来，去掉重叠部分重复识别出的字。
+
+音频可以是一次性到齐的，也可以是边接收边切分的：
+
+splitter = Splitter(16000, 15, 2)
+for window in splitter.feed(已收到的字节数): ...   # 凑够了一整个窗口就返回
+for window in splitter.finish(总字节数): ...       # 音频结束后，返回剩下的窗口
+
+Splitter 按固定长度切分；SilenceSplitter 读取音频文件，在停顿处切分，停顿处的窗口之间不必重叠：
+
+splitter = SilenceSplitter(16000, 'audio.pcm', 12, 24, 2)
+
+'''
+
+__all__ = ['Window', 'Splitter', 'SilenceSplitter', 'Stitcher']
+
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class Window:
+    index: int      # 第几个窗口
+    start: int      # 起始字节
+    end: int        # 结束字节
+    is_first: bool
+    is_last: bool
+    step: float     # 从本窗口起点到下一个窗口起点的秒数
+    head: float     # 与前一个窗口重叠的秒数
+    tail: float     # 与后一个窗口重叠的秒数
+
+
+class Splitter:
+    '''以 chunk_seconds 为步长，切出长 chunk_seconds + overlap_seconds 的窗口'''
+
+    def __init__(self, sample_rate: int, chunk_seconds: int, overlap_seconds: int):
+        self.chunk_seconds = chunk_seconds
+        self.overlap_seconds = overlap_seconds
+        self.chunk_bytes = sample_rate * chunk_seconds * 2       # 每帧数据 2Byte
+        self.overlap_bytes = sample_rate * overlap_seconds * 2
+        self.next_start = 0     # 下一个窗口的起始字节
+        self.index = 0
+
+    def _window(self, total: int) -> Window:
+        start = self.next_start
+        end = min(start + self.chunk_bytes + self.overlap_bytes, total)
+        window = Window(self.index, start, end,
+                        is_first=(start == 0),
+                        is_last=(start + self.chunk_bytes >= total),
+                        step=self.chunk_seconds, 
+                        head=self.overlap_seconds, 
+                        tail=self.overlap_seconds)
+        self.next_start += self.chunk_bytes
+        self.index += 1
+        return window
+
+    def feed(self, available: int) -> list[Window]:
+        '''已经收到 available 字节，返回其中已完整、且肯定不是最后一段的窗口'''
+        windows = []
+        while self.next_start + self.chunk_bytes + self.overlap_bytes < available:
+            windows.append(self._window(available))
+        return windows
+
+    def finish(self, total: int) -> list[Window]:
+        '''音频总长为 total 字节，返回剩下的所有窗口'''
+        windows = []
+        while self.next_start < total:
+            windows.append(self._window(total))
+        return windows
+
+
+class SilenceSplitter:
+    '''
+    在停顿处切分：在窗口起点之后 min_seconds 到 max_seconds 的范围内，找平均能量最低的一小段，
+    作为下一个窗口的起点。如果那里确实是停顿，两个窗口不重叠，不必重复识别，也不必去重；
+    如果一直在说话，找不到停顿，就和 Splitter 一样重叠 overlap_seconds，拼接时照常去重
+    音频从 file 里以内存映射方式读取，流式接收时，已收到的部分要先写入文件
+    '''
+
+    frame_seconds = 0.01    # 按 10ms 一帧计算能量
+    smooth_seconds = 0.2    # 能量取 200ms 的滑动平均，避开字与字之间极短的间隙
+    pause_ratio = 0.1       # 平均能量低于范围内中位数的这个比例，算作停顿
+    pause_energy = 100**2   # 或者低于这个绝对值（均方根约 -50dBFS），也算作停顿
+
+    def __init__(self, sample_rate: int, file, min_seconds: int, max_seconds: int, overlap_seconds: int):
+        self.sample_rate = sample_rate
+        self.file = file
+        self.min_bytes = sample_rate * min_seconds * 2
+        self.max_bytes = sample_rate * max_seconds * 2
+        self.overlap_bytes = sample_rate * overlap_seconds * 2
+        self.next_start = 0     # 下一个窗口的起始字节
+        self.head = 0           # 下一个窗口与前一个窗口重叠的字节数
+        self.index = 0
+
+    def _pause(self, start: int) -> tuple[int, bool]:
+        '''在 start 之后 min_seconds 到 max_seconds 的范围内找能量最低处，返回 (字节位置, 是否是停顿)'''
+        frame = int(self.sample_rate * self.frame_seconds)
+        smooth = int(self.smooth_seconds / self.frame_seconds)
+        low, high = start + self.min_bytes, start + self.max_bytes
+        n = (high - low) // 2 // frame
+        if n <= smooth: return high, False
+
+        pcm = np.memmap(self.file, dtype=np.int16, mode='r', offset=low, shape=(n * frame,))
+        x = np.asarray(pcm, dtype=np.float32).reshape(n, frame)
+        del pcm
+        energy = np.einsum('ij,ij->i', x, x) / frame                # 每帧的均方能量
+        total = np.concatenate(([0], np.cumsum(energy, dtype=np.float64)))
+        smoothed = (total[smooth:] - total[:-smooth]) / smooth      # 滑动平均
+        i = int(np.argmin(smoothed))
+        is_pause = smoothed[i] <= max(self.pause_ratio * np.median(smoothed), self.pause_energy)
+        return low + (i + smooth // 2) * frame * 2, bool(is_pause)
+
+    def _window(self, total: int) -> Window:
+        bytes_per_second = self.sample_rate * 2
+        start = self.next_start
+        if total - start <= self.max_bytes:      # 剩下的不超过一个窗口，就是最后一个
+            boundary, tail = total, 0
+        else:
+            boundary, is_pause = self._pause(start)
+            tail = 0 if is_pause else self.overlap_bytes
+        window = Window(self.index, start, min(boundary + tail, total),
+                        is_first=(start == 0),
+                        is_last=(boundary >= total),
+                        step=(boundary - start) / bytes_per_second,
+                        head=self.head / bytes_per_second,
+                        tail=tail / bytes_per_second)
+        self.next_start = boundary
+        self.head = tail
+        self.index += 1
+        return window
+
+    def feed(self, available: int) -> list[Window]:
+        '''已经收到 available 字节，返回其中已完整、且肯定不是最后一段的窗口'''
+        windows = []
+        while self.next_start + self.max_bytes + self.overlap_bytes < available:
+            windows.append(self._window(available))
+        return windows
+
+    def finish(self, total: int) -> list[Window]:
+        '''音频总长为 total 字节，返回剩下的所有窗口'''
+        windows = []
+        while self.next_start < total:
+            windows.append(self._window(total))
+        return windows
+
+
+class Stitcher:
+    '''按窗口顺序拼接识别结果，时间戳加上窗口的偏移，并去掉重叠部分的重复'''
+
+    def __init__(self, sample_rate: int):
+        self.sample_rate = sample_rate
+        self.timestamps = []
+        self.tokens = []
+        self.progress = 0   # 记录已经识别了多少秒
+
+    def restore(self, timestamps: list[float], tokens: list[str], progress: float):
+        '''从断点记录恢复已经拼接好的结果，之后接着 merge 后面的窗口'''
+        self.timestamps = list(timestamps)
+        self.tokens = list(tokens)
+        self.progress = progress
+
+    def merge(self, window: Window, result_timestamps: list[float], result_tokens: list[str]):
+        '''合并一个窗口的结果，返回新增的 (timestamps, tokens)'''
+        tokens = self.tokens
+
+        # 粗去重：去掉前一半重叠部分的字，留下后一半重叠部分的字
+        m = n = len(result_timestamps)
+        for i, timestamp in enumerate(result_timestamps, start=0):
+            if timestamp > window.head / 2:
+                m = i; break
+        for i, timestamp in enumerate(result_timestamps, start=1):
+            n = i
+            if timestamp > window.step + window.tail / 2: break
+        if window.is_first or not window.head: m = 0
+        if window.is_last: n = len(result_timestamps)
+
+        # 细去重，在停顿处切开、没有重叠的窗口不需要
+        if window.head and tokens:
+            if tokens[-2:] == result_tokens[m:n][:2]: m += 2
+            elif tokens[-1:] == result_tokens[m:n][:1]: m += 1
+
+        # 收集结果
+        self.progress = window.start / 2 / self.sample_rate
+        new_timestamps = [t + self.progress for t in result_timestamps[m:n]]
+        new_tokens = [token for token in result_tokens[m:n]]
+        self.timestamps += new_timestamps
+        self.tokens += new_tokens
+
+        # 更新进度
+        self.progress += window.step
+        return new_timestamps, new_tokens
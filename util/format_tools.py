@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 from string import digits, ascii_letters
 
 en_in_zh = re.compile(r"""(?ix)    # i 表示忽略大小写，x 表示开启注释模式
@@ -7,15 +8,27 @@ en_in_zh = re.compile(r"""(?ix)    # i 表示忽略大小写，x 表示开启注
     ([\u4e00-\u9fa5]|[a-z0-9]+)?       # 右是中文，或者英文加空格
 """)
 
+# 拼写出的字母、数字之间的空格
+spelled_out = re.compile(r'((\d) )?(\b\w) ?(?!\w{2})')
+# 测试地址 https://regex101.com/r/1Vtu7V/1
+
+zh_char = re.compile(r'[\u4e00-\u9fa5]')
+
 def replacer(original: re.Match):
-    left : str = original.group(1)
-    center : str = original.group(2)
-    right : str = original.group(3)
-    # 如果拼写字母中间有空格，就把空格都去掉
-    if center:
-        final = re.sub(r'((\d) )?(\b\w) ?(?!\w{2})', r'\2\3', center).strip()
-        # 测试地址 https://regex101.com/r/1Vtu7V/1
-        # final = re.sub(r'(\b\w) (?!\w{2})', r'\1', original.group(2)).strip()
+    left, center, right = original.groups()
+    # 如果英文左边的汉字被前一个组消费了，就要手动去看一下前一个字是不是中文
+    after_zh = not left and zh_char.match(original.string[original.start(2) - 1]) is not None
+    return join_groups(left, center, right, after_zh)
+
+@lru_cache(maxsize=65536)
+def join_groups(left: str, center: str, right: str, after_zh: bool):
+    '''替换结果只取决于这几项，长文本里同样的组合反复出现，缓存起来'''
+    # 如果拼写字母中间有空格，就把空格都去掉，spelled_out 的替换只会删掉空格，中间没空格的不必替换
+    stripped = center.strip()
+    if ' ' not in stripped:
+        final = stripped
+    else:
+        final = spelled_out.sub(lambda m: (m.group(2) or '') + m.group(3), center).strip()
     
     # 如果英文的左边有汉字或英文，给两组之间加上空格
     if left :
@@ -23,8 +36,7 @@ def replacer(original: re.Match):
             final = ' ' + final
         final = left.rstrip() + final
     
-    # 如果英文左边的汉字被前一个组消费了，就要手动去看一下前一个字是不是中文
-    elif re.match(r'[\u4e00-\u9fa5]', original.string[original.start(2) - 1]): 
+    elif after_zh: 
         if center.lstrip(digits) == center:     # 确保中间开头不是数字
             final = ' ' + final
         
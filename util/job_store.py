@@ -0,0 +1,63 @@
+# coding: utf-8
+'''
+长音频任务的断点记录。
+
+每拼接完一个窗口，就把这个窗口新增的字和时间戳，追加写入 <任务键>.jsonl 的一行，
+识别进程崩溃、服务端重启后，同一任务再次提交时，可以从最后一个完成的窗口接着识别，
+不必把几个小时的音频从头再识别一遍。任务完成后删除记录。
+
+用法示例：
+
+store = JobStore('checkpoints')
+store.clean(7)                                          # 删除 7 天前的记录
+count, timestamps, tokens, progress = store.load(key)   # 已完成的窗口数和拼接结果
+store.append(key, index, progress, new_timestamps, new_tokens)
+store.remove(key)
+
+'''
+
+__all__ = ['JobStore']
+
+import json
+import time
+from pathlib import Path
+
+
+class JobStore:
+
+    def __init__(self, store_dir: Path):
+        self.dir = Path(store_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def clean(self, max_age_days: float):
+        '''清理很久没有再提交的任务留下的记录'''
+        deadline = time.time() - max_age_days * 24 * 3600
+        for file in self.dir.glob('*.jsonl'):
+            try:
+                if file.stat().st_mtime < deadline: file.unlink()
+            except OSError: ...
+
+    def load(self, key: str) -> tuple[int, list[float], list[str], float]:
+        '''返回 (已完成的窗口数, 时间戳, 字, 已识别的秒数)，没有记录时窗口数为 0'''
+        count, timestamps, tokens, progress = 0, [], [], 0
+        try:
+            with open(self.dir / f'{key}.jsonl', 'r', encoding='utf-8') as f:
+                for line in f:
+                    try: record = json.loads(line)
+                    except ValueError: break            # 写到一半就中断的行，之后的都不要
+                    if record['index'] != count: break  # 窗口必须是连续的
+                    timestamps += record['timestamps']
+                    tokens += record['tokens']
+                    progress = record['progress']
+                    count += 1
+        except OSError:
+            ...
+        return count, timestamps, tokens, progress
+
+    def append(self, key: str, index: int, progress: float, timestamps: list[float], tokens: list[str]):
+        record = {'index': index, 'progress': progress, 'timestamps': timestamps, 'tokens': tokens}
+        with open(self.dir / f'{key}.jsonl', 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def remove(self, key: str):
+        (self.dir / f'{key}.jsonl').unlink(missing_ok=True)
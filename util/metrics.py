@@ -0,0 +1,184 @@
+# coding: utf-8
+'''
+服务端的运行统计，以 Prometheus 的文本格式在本地 HTTP 端口上提供。
+
+只有计数、数值、直方图三种，每种最多带一个标签，够看出时间花在哪个阶段、队列有多深就行，
+不依赖 prometheus_client。识别进程、文本进程不直接改这里的统计，
+而是用 timer 把各阶段耗时记到一个普通的 dict 里，随结果送回主进程，再由主进程记入。
+
+用法示例：
+
+registry = Registry()
+stage_seconds = registry.histogram('subwriter_stage_seconds', '各阶段耗时', label='stage')
+queue_depth = registry.gauge('subwriter_queue_depth', '排队的任务数', function=lambda: queue.qsize())
+
+stages = {}
+with timer(stages, 'decode'): ...
+for stage, records in stages.items():
+    for started, seconds in records: stage_seconds.observe(seconds, stage)
+
+serve(registry, '127.0.0.1', 6009)      # http://127.0.0.1:6009/metrics
+
+'''
+
+__all__ = ['Registry', 'Counter', 'Gauge', 'Histogram', 'timer', 'serve']
+
+import math
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def format_value(value: float) -> str:
+    if value == math.inf: return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def format_labels(labels: dict) -> str:
+    if not labels: return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name: str, help: str, label: str = None, lock: threading.Lock = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.lock = lock or threading.Lock()
+        self.values = {}    # 标签值 → 统计值，不带标签的，标签值为 None
+
+    def labels(self, label_value) -> dict:
+        return {self.label: label_value} if self.label else {}
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        return [(self.name, self.labels(label_value), value) for label_value, value in self.values.items()]
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self.lock:
+            for name, labels, value in self.samples():
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    '''只增不减的累计值'''
+    type = 'counter'
+
+    def inc(self, value: float = 1, label_value=None):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + value
+
+
+class Gauge(Metric):
+    '''可增可减的当前值，给了 function 的话，每次读取时调用它得到当前值'''
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, label: str = None, lock: threading.Lock = None, function=None):
+        super().__init__(name, help, label, lock)
+        self.function = function
+
+    def set(self, value: float, label_value=None):
+        with self.lock:
+            self.values[label_value] = value
+
+    def samples(self):
+        if self.function is None: return super().samples()
+        try: value = self.function()
+        except Exception: return []
+        return [(self.name, {}, value)]
+
+
+class Histogram(Metric):
+    '''按上限分桶计数，同时记总和与次数，可以算平均值和分位数'''
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, label: str = None, lock: threading.Lock = None,
+                 buckets: tuple[float] = default_buckets):
+        super().__init__(name, help, label, lock)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value: float, label_value=None):
+        with self.lock:
+            counts, total = self.values.get(label_value, ([0] * len(self.buckets), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: counts[i] += 1
+            self.values[label_value] = counts, total + value
+
+    def samples(self):
+        samples = []
+        for label_value, (counts, total) in self.values.items():
+            labels = self.labels(label_value)
+            for bound, count in zip(self.buckets, counts):
+                samples.append((f'{self.name}_bucket', {**labels, 'le': format_value(bound)}, count))
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, counts[-1]))
+        return samples
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, label: str = None) -> Counter:
+        return self.add(Counter(name, help, label))
+
+    def gauge(self, name: str, help: str, label: str = None, function=None) -> Gauge:
+        return self.add(Gauge(name, help, label, function=function))
+
+    def histogram(self, name: str, help: str, label: str = None, buckets: tuple[float] = default_buckets) -> Histogram:
+        return self.add(Histogram(name, help, label, buckets=buckets))
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+@contextmanager
+def timer(stages: dict, stage: str):
+    '''把这一段的 (开始时间, 耗时) 追加到 stages[stage]，stages 是普通 dict，可以经队列传给别的进程'''
+    started = time.time(); t1 = time.perf_counter()
+    try: yield
+    finally: stages.setdefault(stage, []).append((started, time.perf_counter() - t1))
+
+
+def serve(registry: Registry, addr: str, port: int) -> ThreadingHTTPServer:
+    '''在后台线程里提供 http://addr:port/metrics'''
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404); return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args): ...      # 不在控制台刷屏
+
+    server = ThreadingHTTPServer((addr, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    registry = Registry()
+    jobs = registry.counter('demo_jobs_total', '任务数', label='result')
+    stage_seconds = registry.histogram('demo_stage_seconds', '各阶段耗时', label='stage', buckets=(0.01, 0.1, 1))
+    stages = {}
+    with timer(stages, 'sleep'): time.sleep(0.02)
+    for stage, records in stages.items():
+        for started, seconds in records: stage_seconds.observe(seconds, stage)
+    jobs.inc(label_value='done')
+    print(registry.render())
@@ -0,0 +1,83 @@
+# coding: utf-8
+'''
+分窗口加标点。
+
+整段文本一次送进标点模型，几个小时的音频就是一个极长的序列，内存和耗时都随长度增长，
+出一次错整段都没有标点。这里把文本切成有限长度的窗口，每个窗口两侧各带一段上下文，
+多个窗口同时送入模型，每个位置的标点只取自「这个位置在其正中部分」的那个窗口，
+窗口边缘的标点有上下文可参考，拼接处不会多出或丢掉标点。
+某个窗口出错，只有这个窗口的正中部分不加标点，其余照常。
+
+用法示例：
+
+text = punctuate(text, punc_model, window=300, context=30, threads=2)
+
+'''
+
+__all__ = ['punctuate']
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# 英文单词、数字连在一起算一个单位，其余每个字符一个单位，切窗口时不会把单词切开
+unit_pattern = re.compile(r"[a-zA-Z0-9'@]+|.", re.S)
+
+
+def align(original: str, punctuated: str) -> tuple[dict[int, str], set[int]]:
+    '''
+    对比模型输出与原文，找出插入的标点，以及模型去掉的空格（中英文之间的空格，模型会去掉）
+    返回 {原文字符下标: 紧跟在这个字符后面的标点}, {去掉的空格的下标}
+    标点跟在最后一个对上的非空白字符后面，不会记到去掉的空格上
+    '''
+    inserted, dropped = {}, set()
+    i, last = 0, -1                     # last：最后一个对上的非空白字符的下标
+    for char in punctuated:
+        while i < len(original) and original[i].isspace() and original[i] != char:
+            dropped.add(i); i += 1
+        if i < len(original) and original[i].lower() == char.lower():
+            if not char.isspace(): last = i
+            i += 1
+        elif not char.isspace() and not char.isalnum() and last >= 0:
+            inserted[last] = inserted.get(last, '') + char
+    return inserted, dropped
+
+
+def punctuate_window(model, text: str) -> tuple[dict[int, str], set[int]]:
+    try:
+        return align(text, model(text)[0])
+    except Exception as e:
+        print(f'\r加标点出错，这一段不加标点：{e}')
+        return {}, set()
+
+
+def punctuate(text: str, model, window: int = 300, context: int = 30, threads: int = 2) -> str:
+    '''
+    text 切成每 window 个单位一段，每段左右再各带 context 个单位作为上下文送入模型
+    同时有 threads 个窗口在模型中
+    '''
+    units = unit_pattern.findall(text)
+    offsets = [0]                       # 每个单位在原文中的起始下标
+    for unit in units: offsets.append(offsets[-1] + len(unit))
+
+    def run(start: int) -> tuple[dict[int, str], set[int]]:
+        left, right = max(start - context, 0), min(start + window + context, len(units))
+        inserted, dropped = punctuate_window(model, text[offsets[left] : offsets[right]])
+        # 只留下正中部分的标点和去掉的空格，换算回原文的下标
+        core_start, core_end = offsets[start] - offsets[left], offsets[min(start + window, len(units))] - offsets[left]
+        return ({offsets[left] + i: punc for i, punc in inserted.items() if core_start <= i < core_end},
+                {offsets[left] + i for i in dropped if core_start <= i < core_end})
+
+    with ThreadPoolExecutor(threads) as executor:
+        inserted, dropped = {}, set()
+        for result in executor.map(run, range(0, len(units), window)):
+            inserted.update(result[0]); dropped.update(result[1])
+
+    # 把标点插回原文，去掉模型去掉的空格，与整段送入模型的结果一致，中文标点后面也不需要原来的空格
+    pieces = []
+    skip_space = False
+    for i, char in enumerate(text):
+        if i in dropped or (skip_space and char.isspace()): continue
+        pieces.append(char)
+        skip_space = i in inserted
+        if skip_space: pieces.append(inserted[i])
+    return ''.join(pieces)
@@ -0,0 +1,124 @@
+# coding: utf-8
+'''
+识别结果的磁盘缓存。
+
+以「音频 pcm 内容 + 模型与分段配置」的 sha256 为键，把识别结果存为 json 文件，
+同一段音频再次提交时直接返回缓存的结果。
+流式发送时，要收完音频才算得出哈希，所以另外记下「客户端给的文件键 → 音频哈希」，
+同一个文件再次发送时，收到 start 消息就能直接返回结果。
+缓存总大小超过上限时，删除最久没有被用到的文件。
+put、evict 会在多个线程中同时调用，用锁串行。
+
+用法示例：
+
+cache = ResultCache('cache', 1024 * 1024**2, {'paraformer': 'models/paraformer/model.int8.onnx'})
+key = cache.key(data)
+message = cache.get(key)
+if message is None:
+    message = recognize(data)
+    cache.put(key, message)
+cache.link(name, key, len(data))        # name 是客户端给的文件键，带上配置信息算出的哈希
+message, audio_bytes = cache.get_linked(name)
+
+'''
+
+__all__ = ['ResultCache']
+
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+
+
+class ResultCache:
+
+    def __init__(self, cache_dir: Path, max_bytes: int, identity: dict):
+        self.dir = Path(cache_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.identity = json.dumps(identity, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self.total_bytes = sum(size(file) for file in self.files())
+
+    def files(self) -> list[Path]:
+        '''结果文件和文件键的记录'''
+        return [*self.dir.glob('*.json'), *self.dir.glob('*.link')]
+
+    def hasher(self):
+        '''返回已经加入了配置信息的 sha256，流式接收音频时可以边收边 update'''
+        h = hashlib.sha256()
+        h.update(self.identity)
+        return h
+
+    def key(self, data: bytes) -> str:
+        h = self.hasher()
+        h.update(data)
+        return h.hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        file = self.dir / f'{key}.json'
+        try:
+            with open(file, 'r', encoding='utf-8') as f:
+                message = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        try: os.utime(file)     # 更新修改时间，用作最近使用时间
+        except OSError: ...     # 刚好被别的线程删掉了，结果已经读到，照常返回
+        self.hits += 1
+        return message
+
+    def put(self, key: str, message: dict):
+        self.write(self.dir / f'{key}.json', message)
+
+    def link(self, name: str, key: str, audio_bytes: int):
+        '''记下文件键 name 对应的结果 key，以及音频的字节数'''
+        self.write(self.dir / f'{name}.link', {'key': key, 'audio_bytes': audio_bytes})
+
+    def get_linked(self, name: str) -> tuple[dict, int] | None:
+        '''按文件键取结果，返回 (结果, 音频的字节数)，没有记录或结果已被删除的返回 None'''
+        file = self.dir / f'{name}.link'
+        try:
+            with open(file, 'r', encoding='utf-8') as f:
+                link = json.load(f)
+        except (OSError, ValueError):
+            return None
+        message = self.get(link['key'])
+        if message is None: return None
+        try: os.utime(file)
+        except OSError: ...
+        return message, link['audio_bytes']
+
+    def write(self, file: Path, content: dict):
+        with self.lock:
+            temp_file = file.with_suffix('.tmp')
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(content, f, ensure_ascii=False)
+            self.total_bytes -= size(file)
+            os.replace(temp_file, file)     # 先写临时文件再替换，避免读到写了一半的缓存
+            self.total_bytes += size(file)
+            self.evict()
+
+    def evict(self):
+        '''总大小超过上限时，从最久没用到的开始删除'''
+        with self.lock:
+            if self.total_bytes <= self.max_bytes: return
+            files = [(stat.st_mtime, stat.st_size, file) for file in self.files() if (stat := get_stat(file))]
+            for mtime, file_size, file in sorted(files, key=lambda item: item[0]):
+                if self.total_bytes <= self.max_bytes: break
+                file.unlink(missing_ok=True)
+                self.total_bytes -= file_size
+
+
+def get_stat(file: Path) -> os.stat_result | None:
+    '''文件可能已被删除（例如手动清理了缓存目录），返回 None'''
+    try: return file.stat()
+    except OSError: return None
+
+
+def size(file: Path) -> int:
+    stat = get_stat(file)
+    return stat.st_size if stat else 0
@@ -0,0 +1,103 @@
+# coding: utf-8
+'''
+在后处理的过程中，记住每个字来自哪个分词，最后按标点分句，得到每句的起止时间。
+
+token 合并成文本后，要经过调空格、加标点、转数字，字符会增删、改变，
+每一步都用 carry 把「每个字来自哪个分词」的对照表，从处理前的文本搬到处理后的文本上：
+两边相同的字直接对应，增删的空格、标点跟着前一个字，
+其余不同的一小段（二十三 → 23）按比例对应到处理前的那一段。
+
+用法示例：
+
+text, owners = join_tokens(tokens)
+new_text = format_tools.adjust_space(text)
+owners = carry(text, new_text, owners); text = new_text
+for start, end, sentence in split_segments(text, owners, timestamps): ...
+
+'''
+
+__all__ = ['join_tokens', 'carry', 'split_segments']
+
+import re
+
+token_duration = 0.2    # 每个分词持续的秒数，但不超过下一个分词的开始，与 srt_from_txt 相同
+sync_length = 3         # 两边接下来这么多个字（不算空格、标点）相同，才算重新对上
+max_lookahead = 64      # 不同的一段，在两边最多各往后找这么多字
+
+
+def join_tokens(tokens: list[str]) -> tuple[str, list[int]]:
+    '''与 ' '.join(tokens).replace('@@ ', '') 相同，同时返回每个字来自第几个分词'''
+    pieces, owners = [], []
+    for index, token in enumerate(tokens):
+        if token.endswith('@@') and index < len(tokens) - 1:
+            piece = token[:-2]
+        else:
+            piece = token + ' ' if index < len(tokens) - 1 else token
+        pieces.append(piece)
+        owners += [index] * len(piece)
+    return ''.join(pieces), owners
+
+
+def head(text: str, start: int) -> str:
+    '''从 start 开始，不算空格、标点的 sync_length 个字'''
+    return ''.join(char for char in text[start : start + sync_length * 4] if char.isalnum())[:sync_length]
+
+
+def find_sync(before: str, after: str, i: int, j: int) -> tuple[int, int]:
+    '''从 before[i]、after[j] 开始不同，找最近的重新对上的位置，返回两边各跳过的字数'''
+    for total in range(1, 2 * max_lookahead + 1):
+        for skip_before in range(max(total - max_lookahead, 0), min(total, max_lookahead) + 1):
+            a, b = i + skip_before, j + total - skip_before
+            if a > len(before) or b > len(after): continue
+            if a == len(before) and b == len(after): return skip_before, total - skip_before
+            if a == len(before) or b == len(after) or before[a] != after[b]: continue
+            if head(before, a) == head(after, b): return skip_before, total - skip_before
+    return len(before) - i, len(after) - j       # 找不到，剩下的全部按比例对应
+
+
+def carry(before: str, after: str, owners: list[int]) -> list[int]:
+    '''owners 是 before 中每个字来自第几个分词，返回 after 中每个字来自第几个分词'''
+    new_owners = []
+    i = j = 0
+    while j < len(after):
+        if i < len(before) and before[i] == after[j]:
+            new_owners.append(owners[i])
+            i += 1; j += 1
+            continue
+        if i < len(before) and not before[i].isalnum():     # 去掉的空格、标点
+            i += 1; continue
+        if not after[j].isalnum():                          # 加上的空格、标点，跟着前一个字
+            new_owners.append(owners[max(i - 1, 0)] if owners else 0)
+            j += 1; continue
+        skip_before, skip_after = find_sync(before, after, i, j)
+        for k in range(skip_after):
+            if skip_before:                     # 改变了的字，按比例对应到处理前的那一段
+                new_owners.append(owners[i + k * skip_before // skip_after])
+            else:                               # 插入的字，跟着前一个字
+                new_owners.append(owners[max(i - 1, 0)] if owners else 0)
+        i += skip_before; j += skip_after
+    return new_owners
+
+
+def split_segments(text: str, owners: list[int], timestamps: list[float],
+                   separators: str = '，。？') -> list[tuple[float, float, str]]:
+    '''在标点处分句，标点本身不要，返回每句的 (开始时间, 结束时间, 文本)'''
+    segments = []
+    for match in re.finditer(f'[^{separators}]+', text):
+        sentence = match.group()
+        indexes = [owners[k] for k in range(match.start(), match.end()) if not text[k].isspace()]
+        if not indexes or not timestamps: continue
+        first, last = min(indexes), max(indexes)
+        end = timestamps[last] + token_duration
+        if last + 1 < len(timestamps): end = min(end, timestamps[last + 1])
+        segments.append((round(timestamps[first], 3), round(max(end, timestamps[first]), 3), sentence))
+    return segments
+
+
+if __name__ == '__main__':
+    tokens = ['我', '们', '在', 'fo@@', 'o', '二', '十', '三', '号', '见', '面']
+    timestamps = [0.1 * i for i in range(len(tokens))]
+    text, owners = join_tokens(tokens)
+    new_text = '我们在 foo 23 号，见面。'
+    owners = carry(text, new_text, owners)
+    for segment in split_segments(new_text, owners, timestamps): print(segment)
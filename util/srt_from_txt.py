@@ -11,28 +11,51 @@
     
     脚本会找到同文件名的 json 文件，从里面得到字级时间戳，再按照 txt 里面的分行，
     生成正确的 srt 字幕
+
+    匹配方式有两种：
+        align：整篇文本与全部分词按字做编辑距离对齐，先用两边都只出现一次的连续几个字作锚点切成一段段，
+               改动多、删掉了整段也不会错位（默认）
+        greedy：逐行在后面几个分词里找出现在这一行里的字，速度快，但一处对不上，后面可能都会错位
+
+    json 第一次读取后，会在旁边存一个 .words.npy，每个分词的起止时间和字按列存放，
+    之后直接以内存映射方式打开，不必再解析 json、为每个分词建一个 dict
+
+    align 方式会在旁边存一个 .align.json，记下每行对齐到的分词，再次运行时，
+    只重新对齐与上次相比改动过的行。加上 --watch，txt 一保存就重新生成 srt
 """
 
 
 import json
+import time
+import difflib
+from bisect import bisect_left
+from functools import lru_cache
 from datetime import timedelta
 from pathlib import Path
 
 import typer
 import srt
+import numpy as np
 from rich import print
 
+# 对齐时忽略的字符，标点是用户加的，分词里没有
+ignored_chars = ' ,.?!，。？！、'
+anchor_length = 8           # 文本与分词里都只出现一次的连续这么多个字，作为切分整篇的锚点
+max_cells = 1 << 24         # 一段的 行数 × 列数 不超过这么多，就算整个矩阵，不用带
 
-def lines_match_words(text_lines: list[str], words: list[dict[str, str | float]]) -> list[srt.Subtitle]:
+
+def lines_match_words(text_lines: list[str], words: np.ndarray) -> list[srt.Subtitle]:
     """
-    words[0] = {
-                'start': 0.0,
-                'end' : 5.0,
-                'word' : 'good'
-                }
+    words 是 make_words 生成的结构化数组：
+    words['start'][0] = 0.0
+    words['end'][0] = 5.0
+    words['word'][0] = 'good'
     """
     # 空的字幕列表
     subtitle_list = []
+    # float32 的时间取整到毫秒，避免 36.8 存成 36.7999 后，字幕里写成 36,799
+    starts, ends = words['start'].astype(float).round(3).tolist(), words['end'].astype(float).round(3).tolist()
+    tokens = words['word'].tolist()
 
     cursor = 0              # 索引，指向最新已确认的下一个
     words_num = len(words)  # 词数，结束条件
@@ -42,8 +65,8 @@ def lines_match_words(text_lines: list[str], words: list[dict[str, str | float]]
         if not line.replace(' ', ''):
             continue
         temp_text = line
-        t1 = words[cursor]['start']
-        t2 = words[cursor]['end']
+        t1 = starts[cursor]
+        t2 = ends[cursor]
         threshold = 8
         have_match = False
 
@@ -52,9 +75,9 @@ def lines_match_words(text_lines: list[str], words: list[dict[str, str | float]]
         while (not have_match) or (probe - cursor < threshold):
             if probe >= words_num:
                 break  # 探针越界，结束
-            w = words[probe]['word'].strip(' ,.?!，。？！')
-            t3 = words[probe]['start']
-            t4 = words[probe]['end']
+            w = tokens[probe].strip(' ,.?!，。？！')
+            t3 = starts[probe]
+            t4 = ends[probe]
             probe += 1
             if w in temp_text:
                 have_match = True
@@ -73,50 +96,315 @@ def lines_match_words(text_lines: list[str], words: list[dict[str, str | float]]
     return subtitle_list
 
 
-def get_words(json_file: Path) -> list[dict[str, str | float]]:
+def find_anchors(a: str, b: str, length: int) -> list[tuple[int, int]]:
+    """
+    在 a、b 中都只出现一次的、连续 length 个字，作为锚点
+    取其中两边先后顺序一致的最长的一串（最长递增子序列），返回 [(在 a 中的位置, 在 b 中的位置), ...]
+    """
+    def unique(text):
+        positions = {}
+        for i in range(len(text) - length + 1):
+            positions.setdefault(text[i : i + length], []).append(i)
+        return {gram: found[0] for gram, found in positions.items() if len(found) == 1}
+
+    in_b = unique(b)
+    pairs = [(i, in_b[gram]) for gram, i in sorted(unique(a).items(), key=lambda item: item[1]) if gram in in_b]
+
+    tails, tail_pairs, previous = [], [], []      # 长为 k+1 的递增串，结尾最小是 tails[k]
+    for index, (i, j) in enumerate(pairs):
+        k = bisect_left(tails, j)
+        if k == len(tails): tails.append(j); tail_pairs.append(index)
+        else: tails[k] = j; tail_pairs[k] = index
+        previous.append(tail_pairs[k - 1] if k else -1)
+    chain, index = [], tail_pairs[-1] if tail_pairs else -1
+    while index >= 0:
+        chain.append(pairs[index]); index = previous[index]
+    return chain[::-1]
+
+
+def align_chars(a: list[str], b: list[str], band: int = 400) -> np.ndarray:
+    """
+    a 与 b 的编辑距离对齐，返回 a 中每个字对应的 b 的下标，没有对应的为 -1
+
+    先用两边都只出现一次的连续几个字作锚点，把整篇切成一段段，相邻切点在 a 中至少隔 band 个字，
+    每段的首尾都是确定对上的，删掉了整段文字的话，那一段里 b 比 a 长出一截，逐段对齐就不会丢失路径
+    """
+    m, n = len(a), len(b)
+    matched = np.full(m, -1)
+    if not m or not n: return matched
+
+    # 字转为整数编号，便于整行比较
+    codes = {}
+    A = np.array([codes.setdefault(char, len(codes)) for char in a])
+    B = np.array([codes.setdefault(char, len(codes)) for char in b])
+
+    # 最后一个锚点也切开，末尾一段的分词不计代价，不能让删掉的一段混在里面
+    i0 = j0 = 0
+    anchors = find_anchors(''.join(a), ''.join(b), anchor_length)
+    for index, (i, j) in enumerate(anchors):
+        if (i - i0 < band and index < len(anchors) - 1) or i < i0 or j < j0: continue
+        matched[i0:i] = offset(align_segment(A[i0:i], B[j0:j], band, free_end=False), j0)
+        matched[i : i + anchor_length] = np.arange(j, j + anchor_length)
+        i0, j0 = i + anchor_length, j + anchor_length
+    matched[i0:] = offset(align_segment(A[i0:], B[j0:], band, free_end=True), j0)
+    return matched
+
+
+def offset(matched: np.ndarray, j0: int) -> np.ndarray:
+    return np.where(matched >= 0, matched + j0, -1)
+
+
+def align_segment(A: np.ndarray, B: np.ndarray, band: int, free_end: bool) -> np.ndarray:
+    """
+    一段的编辑距离对齐，free_end 为 False 时，a 的最后一个字要对到 b 的末尾
+
+    格子数不多时算整个矩阵，否则只计算以上一行代价最低处为中心、宽 band 的一条带
+    每一行用 numpy 整行计算：来自左边的代价 D[j] = min(C[k] + j - k)，可由 minimum.accumulate 一次得出
+    """
+    m, n = len(A), len(B)
+    matched = np.full(m, -1)
+    if not m or not n: return matched
+
+    inf = 1 << 28
+    width = n if m * n <= max_cells else min(band, n)
+    ks = np.arange(width)
+    los = np.empty(m, dtype=np.int64)                       # 每一行的带从哪一列开始
+    pointers = np.empty((m, width), dtype=np.int8)          # 0：对上（或替换）  1：a 多出的字  2：b 多出的字
+
+    def shifted(row, shift):
+        '''out[t] = row[t + shift]，超出范围的为 inf'''
+        out = np.full(width, inf)
+        if shift >= 0: out[:width - shift] = row[shift:]
+        else: out[-shift:] = row[:width + shift]
+        return out
+
+    prev, prev_lo = ks + 1, 0       # 第 -1 行：删掉 b 的前 j+1 个字
+    for i in range(m):
+        lo = min(max(prev_lo + int(np.argmin(prev)) - width // 2 + 1, 0), n - width)
+        up = shifted(prev, lo - prev_lo) + 1
+        diag = shifted(prev, lo - prev_lo - 1)
+        if lo == 0: diag[0] = i     # D[i-1][-1]
+        diag += (A[i] != B[lo : lo + width])
+        cost = np.minimum(diag, up)
+        row = ks + np.minimum.accumulate(cost - ks)
+        if lo == 0: row = np.minimum(row, i + 2 + ks)       # 从第 -1 列一路向右
+        pointers[i] = np.where(row == diag, 0, np.where(row == up, 1, 2))
+        los[i] = lo
+        prev, prev_lo = row, lo
+
+    # 回溯，free_end 时末尾多出的分词不计代价，代价相同的，取对到更后面的
+    i = m - 1
+    j = n - 1 if not free_end and prev_lo + width == n else prev_lo + width - 1 - int(np.argmin(prev[::-1]))
+    while i >= 0 and j >= 0:
+        pointer = pointers[i, j - los[i]]
+        if pointer == 0:
+            matched[i] = j
+            i -= 1; j -= 1
+        elif pointer == 1: i -= 1
+        else: j -= 1
+    return matched
+
+
+def align_spans(text_lines: list[str], words: np.ndarray, band: int = 400) -> list[tuple[int, int] | None]:
+    """
+    把所有行的字与所有分词的字对齐，返回每行对齐到的 (第一个分词, 最后一个分词)，整行都对不上的为 None
+    """
+    # 文本的字，及其所在的行
+    text_chars, char_lines = [], []
+    for index, line in enumerate(text_lines):
+        for char in line.lower():
+            if char.isspace() or char in ignored_chars: continue
+            text_chars.append(char); char_lines.append(index)
+
+    # 分词的字，及其所在的分词
+    token_chars, char_words = [], []
+    for index, word in enumerate(words['word'].tolist()):
+        for char in word.lower():
+            if char.isspace() or char in ignored_chars: continue
+            token_chars.append(char); char_words.append(index)
+
+    matched = align_chars(text_chars, token_chars, band)
+
+    # 每行对齐到的第一个和最后一个分词
+    spans = [None] * len(text_lines)
+    for line_index, token_index in zip(char_lines, matched.tolist()):
+        if token_index < 0: continue
+        word_index = char_words[token_index]
+        first = spans[line_index][0] if spans[line_index] else word_index
+        spans[line_index] = (first, word_index)
+    return spans
+
+
+def update_spans(old_lines: list[str], old_spans: list, text_lines: list[str], words: np.ndarray) -> list[tuple[int, int] | None]:
+    """
+    与上次的文本逐行比较，没改动的行沿用上次对齐的结果，
+    改动过的几行，只与前后没改动的行之间的那些分词重新对齐
+    """
+    spans = []
+    matcher = difflib.SequenceMatcher(None, old_lines, text_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            spans += old_spans[i1:i2]
+            continue
+        if j1 == j2: continue       # 只删掉了行
+        lo = next((span[1] + 1 for span in reversed(spans) if span), 0)
+        hi = next((span[0] for span in old_spans[i2:] if span), len(words))
+        if lo >= hi:
+            spans += [None] * (j2 - j1); continue
+        for span in align_spans(text_lines[j1:j2], words[lo:hi]):
+            spans.append((span[0] + lo, span[1] + lo) if span else None)
+    return spans
+
+
+def spans_to_subtitles(text_lines: list[str], spans: list, words: np.ndarray) -> list[srt.Subtitle]:
+    """
+    每行的时间从对齐到的第一个字开始，到最后一个字结束
+    整行都对不上的（例如新加的行），时间接在上一行后面
+    """
+    subtitle_list = []
+    previous_end = 0.0
+    starts, ends = words['start'], words['end']
+    for index, (line, span) in enumerate(zip(text_lines, spans)):
+        if not line.replace(' ', '').strip():
+            continue
+        if span:
+            t1 = max(round(float(starts[span[0]]), 3), previous_end)
+            t2 = max(round(float(ends[span[1]]), 3), t1)
+        else:
+            t1 = t2 = previous_end
+        previous_end = t2
+        subtitle = srt.Subtitle(index=index,
+                                content=line,
+                                start=timedelta(seconds=t1),
+                                end=timedelta(seconds=t2))
+        subtitle_list.append(subtitle)
+    return subtitle_list
+
+
+def lines_align_words(text_lines: list[str], words: np.ndarray, band: int = 400) -> list[srt.Subtitle]:
+    return spans_to_subtitles(text_lines, align_spans(text_lines, words, band), words)
+
+
+def make_words(timestamps: list[float], tokens: list[str]) -> np.ndarray:
+    """
+    把时间戳和分词转为结构化数组，每个分词占一行定长记录：起止时间为 float32，字为定长 unicode
+    每个分词持续 0.2 秒，但不超过下一个分词的开始
+    """
+    tokens = [token.replace('@', '') for token in tokens]
+    width = max(map(len, tokens), default=1) or 1
+    words = np.empty(len(tokens), dtype=[('start', '<f4'), ('end', '<f4'), ('word', f'<U{width}')])
+    words['start'] = timestamps
+    words['end'] = words['start'] + np.float32(0.2)
+    words['end'][:-1] = np.minimum(words['end'][:-1], words['start'][1:])
+    words['word'] = tokens
+    return words
+
+
+def get_words(json_file: Path) -> np.ndarray:
+    # 旁边有比 json 新的 .words.npy，就直接内存映射打开
+    npy_file = json_file.with_suffix('.words.npy')
+    try:
+        if npy_file.stat().st_mtime_ns > json_file.stat().st_mtime_ns:
+            return np.load(npy_file, mmap_mode='r')
+    except (OSError, ValueError): ...
+
     # 读取分词 json 文件
     with open(json_file, 'r', encoding='utf-8') as f:
         json_info = json.load(f)
 
-    # 获取带有时间戳的分词列表
-    words = [{'word': token.replace('@', ''), 'start': timestamp, 'end': timestamp + 0.2} 
-             for (timestamp, token) in zip(json_info['timestamps'], json_info['tokens'])]
-    for i in range(len(words) - 1):
-        words[i]['end'] = min(words[i]['end'], words[i+1]['start'])
-    
+    # 获取带有时间戳的分词数组，存一份 .words.npy 供下次使用
+    words = make_words(json_info['timestamps'], json_info['tokens'])
+    try: np.save(npy_file, words)
+    except OSError: ...
     return words
 
 
+@lru_cache(maxsize=8)
+def cached_words(json_file: Path, mtime_ns: int) -> np.ndarray:
+    # 监视模式下，json 没变就不必每次重新读取
+    return get_words(json_file)
+
+
 def get_lines(txt_file: Path) -> list[str]:
     # 读取分好行的字幕
     with open(txt_file, 'r', encoding='utf-8') as f:
         text_lines = f.readlines()
     return text_lines
 
-def one_task(media_file: Path):
+def load_state(state_file: Path, json_file: Path) -> dict | None:
+    """读取上次对齐的结果，json 文件变了（重新识别过）的话，就作废"""
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stat = json_file.stat()
+    if state.get('json') != [stat.st_size, stat.st_mtime_ns]: return None
+    return state
+
+
+def save_state(state_file: Path, json_file: Path, text_lines: list[str], spans: list):
+    stat = json_file.stat()
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump({'json': [stat.st_size, stat.st_mtime_ns], 
+                   'lines': text_lines, 
+                   'spans': spans}, f, ensure_ascii=False)
+
+
+def one_task(media_file: Path, mode: str = 'align'):
     # 配置要打开的文件
     txt_file = media_file.with_suffix('.txt')
     json_file = media_file.with_suffix('.json')
     srt_file = media_file.with_suffix('.srt')
+    state_file = media_file.with_suffix('.align.json')
     if (not txt_file.exists()) or (not json_file.exists()):
         print(f'无法找到 {media_file}对应的txt、json文件，跳过')
         return None
 
     # 获取带有时间戳的分词列表，获取分行稿件，匹配得到 srt 
-    words = get_words(json_file)
+    words = cached_words(json_file, json_file.stat().st_mtime_ns)
     text_lines = get_lines(txt_file)
-    subtitle_list = lines_match_words(text_lines, words)
+    if mode == 'greedy':
+        subtitle_list = lines_match_words(text_lines, words)
+    else:
+        # 有上次的对齐结果，就只对齐改动过的行
+        state = load_state(state_file, json_file)
+        if state:
+            spans = update_spans(state['lines'], [tuple(span) if span else None for span in state['spans']], text_lines, words)
+        else:
+            spans = align_spans(text_lines, words)
+        save_state(state_file, json_file, text_lines, spans)
+        subtitle_list = spans_to_subtitles(text_lines, spans, words)
 
     # 写入 srt
     with open(srt_file, 'w', encoding='utf-8') as f:
         f.write(srt.compose(subtitle_list))
 
-def main(files: list[Path]):
+def watch(files: list[Path], mode: str):
+    """每隔一小会儿检查一次 txt 的修改时间，保存过就重新生成 srt，按 Ctrl+C 结束"""
+    mtimes = {}
+    print('正在监视 txt 文件的修改，按 Ctrl+C 结束')
+    try:
+        while True:
+            for file in files:
+                txt_file = file.with_suffix('.txt')
+                try: mtime = txt_file.stat().st_mtime_ns
+                except OSError: continue
+                if mtimes.get(file) == mtime: continue
+                mtimes[file] = mtime
+                t1 = time.time()
+                one_task(file, mode)
+                print(f'已更新：{file.with_suffix(".srt")}，耗时 {(time.time() - t1) * 1000:.0f}ms')
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        ...
+
+def main(files: list[Path], mode: str = 'align', watch_txt: bool = typer.Option(False, '--watch')):
+    if watch_txt: 
+        watch(files, mode); return
     for file in files:
-        one_task(file)
+        one_task(file, mode)
         print(f'写入完成：{file}')
 
 if __name__ == '__main__':
     typer.run(main)
-        
-
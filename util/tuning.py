@@ -0,0 +1,77 @@
+# coding: utf-8
+'''
+识别进程数与每个进程的线程数的自动选择。
+
+同样是 8 个核，是 1 个进程 × 8 线程快，还是 4 个进程 × 2 线程快，取决于机器和模型，
+这里列出 线程数 × 进程数 不超过核数的各种组合，由调用方逐个实测，
+按吞吐量（多个任务同时识别）或延迟（单段识别最快）选出最好的一种，存入 json 文件，
+之后启动时，只要机器和模型没变，就直接沿用。
+
+用法示例：
+
+identity = {'cpu_count': os.cpu_count(), 'model': 'models/paraformer/model.int8.onnx'}
+choice = load('models/tuning.json', identity, 'throughput')
+if choice is None:
+    results = [measure(threads, workers) for threads, workers in candidates(os.cpu_count(), 8)]
+    choice = choose(results, 'throughput')
+    save('models/tuning.json', identity, 'throughput', choice, results)
+num_threads, num_workers = choice['threads'], choice['workers']
+
+measure 返回 {'threads': 线程数, 'workers': 进程数, 'throughput': 每秒识别多少秒音频, 'latency': 每段平均耗时}
+
+'''
+
+__all__ = ['candidates', 'choose', 'load', 'save']
+
+import os
+import json
+import time
+from pathlib import Path
+
+
+def candidates(cores: int, max_workers: int) -> list[tuple[int, int]]:
+    '''线程数取 1、2、4… 和核数本身，进程数从 1 到 核数 // 线程数，不超过 max_workers'''
+    threads_list = sorted({2**i for i in range(cores.bit_length()) if 2**i <= cores} | {cores})
+    return [(threads, workers)
+            for threads in threads_list
+            for workers in range(1, min(cores // threads, max_workers) + 1)]
+
+
+def choose(results: list[dict], objective: str) -> dict:
+    '''throughput：吞吐量最高的；latency：每段耗时最短的，差不多的（5% 以内）再比吞吐量'''
+    if objective == 'latency':
+        best = min(result['latency'] for result in results)
+        results = [result for result in results if result['latency'] <= best * 1.05]
+    return max(results, key=lambda result: result['throughput'])
+
+
+def load(file: Path, identity: dict, objective: str) -> dict | None:
+    '''读取之前的选择，机器、模型或目标不同的话，返回 None'''
+    try:
+        with open(file, 'r', encoding='utf-8') as f:
+            tuning = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if tuning.get('identity') != identity or tuning.get('objective') != objective: return None
+    return tuning.get('choice')
+
+
+def save(file: Path, identity: dict, objective: str, choice: dict, results: list[dict]):
+    file = Path(file)
+    temp_file = file.with_suffix('.tmp')
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump({'identity': identity,
+                   'objective': objective,
+                   'choice': choice,
+                   'results': results,
+                   'time': time.strftime('%Y-%m-%d %H:%M:%S')}, f, ensure_ascii=False, indent=4)
+    os.replace(temp_file, file)
+
+
+if __name__ == '__main__':
+    for cores in (1, 4, 6, 8):
+        print(cores, candidates(cores, 8))
+    results = [{'threads': 1, 'workers': 4, 'throughput': 40, 'latency': 0.8},
+               {'threads': 4, 'workers': 1, 'throughput': 25, 'latency': 0.3},
+               {'threads': 2, 'workers': 2, 'throughput': 35, 'latency': 0.45}]
+    print(choose(results, 'throughput'), choose(results, 'latency'))